@@ -2,14 +2,20 @@ import numpy as np
 import sys
 import os
 import json
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "sim"))
+from record_file import read_records, RECORD_FILE_EXTENSION, MISSING_VALUE
 
 RESULTS_DIR_NAME = "results/"
-RESULTS_SUBDIR_NAME = RESULTS_DIR_NAME + "sim_{}/"
+SIM_DIR_NAME = "sim_{}/"
+RESULTS_SUBDIR_NAME = RESULTS_DIR_NAME + SIM_DIR_NAME
 THREAD_RUN_FORMAT = "{}_t{}"
-CPU_FILE_NAME = "cpu_usage.csv"
-TASK_FILE_NAME = "task_times.csv"
+CPU_NAME = "cpu_usage"
+TASK_NAME = "task_times"
 META_FILE_NAME = "meta.json"
 STATS_FILE_NAME = "stats.json"
+CACHE_FILE_NAME = "analysis_cache.json"
 CSV_HEADER = "Run ID,Cores,Sim Duration,Average Task Duration,Load,CPU Load,Task Load,Work Steal Load," \
              "95% Tail Latency,99.9% Tail Latency,Median Latency,99% Tail Latency,Tasks Stolen,Average Number of Steals,Throughput," \
              "Real Load, Parks Per Second,Successful Work Steal Time,Unsuccessful Work Steal Time,Non Work Conserving Time,Allocation Time," \
@@ -17,13 +23,104 @@ CSV_HEADER = "Run ID,Cores,Sim Duration,Average Task Duration,Load,CPU Load,Task
              "Avg Steals Per Task,Flag Response Rate,Flag Rate,Tasks Flag Stolen,Average Steals Per Flag,Avg Core Flag Wait Time," \
              "Avg Task Flag Wait Time,Avg Queueing Time,Avg High Latency Task Flag Wait Time,Avg Flag Set Delay Time,Avg High Latency Flag Set Delay Time," \
              "Avg Flagged Task Service Time,Avg Flagged Task Time Left,Pct Flagged Queues Non-empty,Description"
+# Names of the metrics computed for each run (all columns other than the run ID and description)
+METRIC_NAMES = [x.strip() for x in CSV_HEADER.split(",")[1:-1]]
 
 
 def analyze_sim_run(run_name, output_file, print_results=False, time_dropped=0):
-    cpu_file = open(RESULTS_SUBDIR_NAME.format(run_name) + CPU_FILE_NAME, "r")
-    task_file = open(RESULTS_SUBDIR_NAME.format(run_name) + TASK_FILE_NAME, "r")
-    meta_file = open(RESULTS_SUBDIR_NAME.format(run_name) + META_FILE_NAME, "r")
-    stats_file = open(RESULTS_SUBDIR_NAME.format(run_name) + STATS_FILE_NAME, "r")
+    write_summary(run_name, run_summary(run_name, time_dropped), output_file)
+
+
+def write_summary(run_name, summary, output_file):
+    """Write the row of a run's summary to the output file."""
+    data_string = ",".join([run_name[4:]] + [str(x) for x in summary["values"]] +
+                           ["\"{}\"".format(summary["description"])])
+    output_file.write(data_string + "\n")
+
+
+def input_signature(run_dir):
+    """Return the modification times and sizes of the files that the metrics of a run are computed from."""
+    signature = {}
+    for file_name in sorted(os.listdir(run_dir)):
+        if file_name in [META_FILE_NAME, STATS_FILE_NAME] or file_name.split(".")[0] in [CPU_NAME, TASK_NAME]:
+            file_stats = os.stat(run_dir + file_name)
+            signature[file_name] = [file_stats.st_mtime_ns, file_stats.st_size]
+    return signature
+
+
+def cached_summary(run_name, time_dropped=0, results_dir=RESULTS_DIR_NAME):
+    """Return the cached summary of a run, or None if it was not analyzed with this time dropped since it changed."""
+    run_dir = results_dir + SIM_DIR_NAME.format(run_name)
+    if not os.path.isfile(run_dir + CACHE_FILE_NAME):
+        return None
+    cache_file = open(run_dir + CACHE_FILE_NAME, "r")
+    cache = json.load(cache_file)
+    cache_file.close()
+
+    summary = cache.get(str(time_dropped))
+    if summary is None or summary["files"] != input_signature(run_dir):
+        return None
+    return summary
+
+
+def run_summary(run_name, time_dropped=0, results_dir=RESULTS_DIR_NAME):
+    """Return the metrics and description of a run, from the cache if it is up to date.
+    Otherwise the metrics are computed and cached in the run's directory.
+    """
+    summary = cached_summary(run_name, time_dropped, results_dir)
+    if summary is not None:
+        return summary
+
+    run_dir = results_dir + SIM_DIR_NAME.format(run_name)
+    signature = input_signature(run_dir)
+    meta_file = open(run_dir + META_FILE_NAME, "r")
+    description = json.load(meta_file)["description"]
+    meta_file.close()
+    summary = {"files": signature, "description": description,
+               "values": [x.item() if isinstance(x, np.generic) else x
+                          for x in sim_run_metrics(run_name, time_dropped, results_dir)]}
+
+    # Summaries for other dropped times are kept, and the cache is replaced at once so it is never partially written
+    cache = {}
+    if os.path.isfile(run_dir + CACHE_FILE_NAME):
+        cache_file = open(run_dir + CACHE_FILE_NAME, "r")
+        cache = json.load(cache_file)
+        cache_file.close()
+    cache[str(time_dropped)] = summary
+    cache_file = open(run_dir + CACHE_FILE_NAME + ".tmp", "w")
+    json.dump(cache, cache_file)
+    cache_file.close()
+    os.replace(run_dir + CACHE_FILE_NAME + ".tmp", run_dir + CACHE_FILE_NAME)
+    return summary
+
+
+def summarize(args):
+    """Return the summary of a run for a worker process."""
+    return run_summary(*args)
+
+
+def load_columns(run_dir, name):
+    """Return the columns of a results file as a list of integer arrays.
+    Binary results are memory-mapped rather than copied, otherwise the CSV file is parsed. Values that are not set are
+    MISSING_VALUE in both forms.
+    """
+    if os.path.isfile(run_dir + name + RECORD_FILE_EXTENSION):
+        records = read_records(run_dir + name + RECORD_FILE_EXTENSION)
+        return [records[column] for column in records.dtype.names]
+
+    csv_file = open(run_dir + name + ".csv", "r")
+    column_count = len(csv_file.readline().split(","))
+    table = np.loadtxt((line.replace("None", str(MISSING_VALUE)) for line in csv_file), delimiter=",", dtype=np.int64,
+                       ndmin=2)
+    csv_file.close()
+    return list(table.reshape(-1, column_count).T)
+
+
+def sim_run_metrics(run_name, time_dropped=0, results_dir=RESULTS_DIR_NAME):
+    """Return the values of the metrics in METRIC_NAMES for a run."""
+    run_dir = results_dir + SIM_DIR_NAME.format(run_name)
+    meta_file = open(run_dir + META_FILE_NAME, "r")
+    stats_file = open(run_dir + STATS_FILE_NAME, "r")
 
     meta_data = json.load(meta_file)
     stats = json.load(stats_file)
@@ -31,44 +128,13 @@ def analyze_sim_run(run_name, output_file, print_results=False, time_dropped=0):
     meta_file.close()
     stats_file.close()
 
-    # CPU Stats
-    busy_time = 0
-    task_time = 0
-    work_steal_time = 0
-    work_search_spin_time = 0
-    enqueue_time = 0
-    requeue_time = 0
-    successful_ws_time = 0
-    unsuccessful_ws_time = 0
-    allocation_time = 0
-    non_work_conserving_time = 0
-    distracted_time = 0
-    unpaired_time = 0
-    paired_time = 0
-    flag_task_time = 0
-    flag_wait_time = 0
-
-    next(cpu_file) # skip first line
-    for line in cpu_file:
-        data = line.strip().split(",")
-        busy_time += int(data[1])
-        task_time += int(data[2])
-        work_steal_time += int(data[3])
-        work_search_spin_time += int(data[4])
-        enqueue_time += int(data[5])
-        requeue_time += int(data[6])
-        successful_ws_time += int(data[7])
-        unsuccessful_ws_time += int(data[8])
-        allocation_time += int(data[9])
-        non_work_conserving_time += int(data[10])
-        distracted_time += int(data[11])
-        unpaired_time += int(data[12])
-        paired_time += int(data[13])
-        if len(data) > 14:
-            flag_task_time += int(data[14])
-            flag_wait_time += int(data[15])
-
-    cpu_file.close()
+    # CPU Stats (one row per thread)
+    cpu = load_columns(run_dir, CPU_NAME)
+    busy_time, task_time, work_steal_time, work_search_spin_time, enqueue_time, requeue_time, successful_ws_time, \
+        unsuccessful_ws_time, allocation_time, non_work_conserving_time, distracted_time, unpaired_time, \
+        paired_time = [int(x.sum()) for x in cpu[1:14]]
+    flag_task_time = int(cpu[14].sum()) if len(cpu) > 14 else 0
+    flag_wait_time = int(cpu[15].sum()) if len(cpu) > 14 else 0
 
     cores = meta_data["num_threads"]
     avg_load = (busy_time/(cores * stats["End Time"]))
@@ -76,73 +142,47 @@ def analyze_sim_run(run_name, output_file, print_results=False, time_dropped=0):
     avg_task_load = (task_time/(task_time + work_steal_time + work_search_spin_time + allocation_time + enqueue_time + requeue_time + flag_task_time))
     avg_core_flag_wait_time = flag_wait_time / (cores * stats["End Time"])
 
-    # Task Stats
-    task_latencies = []
-    flagged_task_service_times = []
-    flagged_task_time_left = []
+    # Task Stats (one row per task, only completed tasks that arrived after the dropped time are counted)
+    tasks = load_columns(run_dir, TASK_NAME)
+    kept = (tasks[0] > time_dropped * stats["End Time"]) & (tasks[1] >= 0)
+    tasks = [x[kept] for x in tasks]
 
     complete_tasks = stats["Completed Tasks"]
-    total_tasks = 0
-    tasks_stolen = 0
-    total_steals = 0
-    total_flag_steals = 0
+    total_tasks = int(kept.sum())
+    total_queueing_time = int((tasks[1] - tasks[2]).sum())
+    total_requeue_wait_time = int(tasks[9].sum())
+
+    stolen = tasks[3] > 0
+    tasks_stolen = int(stolen.sum())
+    total_steals = int(tasks[3][stolen].sum())
+
+    percentiles = np.percentile(tasks[1], [95, 99.9, 50, 99])
+
+    # Flag stats, overall and for tasks in the 99.9% tail (only recorded with delay flagging)
     tasks_flag_stolen = 0
+    total_flag_steals = 0
     total_flag_wait_time = 0
     total_flag_set_delay = 0
-    total_queueing_time = 0
-    total_requeue_wait_time = 0
-    next(task_file) # skip first line
-    for line in task_file:
-        data = line.split(",")
-        if int(data[0]) > time_dropped * stats["End Time"] and int(data[1]) >= 0:
-            total_tasks += 1
-            task_latencies.append(int(data[1]))
-            total_queueing_time += (int(data[1])) - int(data[2])
-            total_requeue_wait_time += int(data[9])
-            steals = int(data[3])
-            flag_steals = int(data[10]) if len(data) > 10 else 0
-            if steals > 0:
-                tasks_stolen += 1
-                total_steals += steals
-            if flag_steals > 0:
-                tasks_flag_stolen += 1
-                total_flag_steals += flag_steals
-                if len(data) > 11:
-                    total_flag_wait_time += int(data[11])
-                if len(data) > 12:
-                    total_flag_set_delay += int(data[12])
-            if len(data) > 12 and data[13] == 1:
-                flagged_task_service_times.append(int(data[2]))
-                flagged_task_time_left.append(int(data[14]))
-
-    percentiles = np.percentile(task_latencies, [95, 99.9, 50, 99])
-
-    ## 99.9% Tail Flag Stats
-    tasks_stolen_999 = 0
-    tasks_999 = 0
-    tasks_flag_stolen_999 = 0
-    total_flag_wait_time_999 = 0
     total_flag_steals_999 = 0
+    total_flag_wait_time_999 = 0
     total_flag_set_delay_999 = 0
-    task_file.seek(0,0)
-    next(task_file)
-    for line in task_file:
-        data = line.split(",")
-        if int(data[0]) > time_dropped * stats["End Time"] and int(data[1]) >= percentiles[1]:
-            tasks_999 += 1
-            if int(data[3]) > 0:
-                tasks_stolen_999 += 1
-    if len(data) > 10:
-        for line in task_file:
-            data = line.split(",")
-            if int(data[0]) > time_dropped * stats["End Time"] and int(data[1]) >= percentiles[1] and int(data[10]) > 0:
-                tasks_flag_stolen_999 += 1
-                total_flag_steals_999 += int(data[10])
-                if len(data) > 11:
-                    total_flag_wait_time_999 += int(data[11])
-                    total_flag_set_delay_999 += int(data[12])
-
-    task_file.close()
+    flagged_task_service_times = tasks[2][:0]
+    flagged_task_time_left = tasks[2][:0]
+    if len(tasks) > 10:
+        flag_stolen = tasks[10] > 0
+        tail_flag_stolen = flag_stolen & (tasks[1] >= percentiles[1])
+        tasks_flag_stolen = int(flag_stolen.sum())
+        total_flag_steals = int(tasks[10][flag_stolen].sum())
+        total_flag_steals_999 = int(tasks[10][tail_flag_stolen].sum())
+        if len(tasks) > 12:
+            total_flag_wait_time = int(tasks[11][flag_stolen].sum())
+            total_flag_set_delay = int(tasks[12][flag_stolen].sum())
+            total_flag_wait_time_999 = int(tasks[11][tail_flag_stolen].sum())
+            total_flag_set_delay_999 = int(tasks[12][tail_flag_stolen].sum())
+        if len(tasks) > 14:
+            flagged = tasks[13] == 1
+            flagged_task_service_times = tasks[2][flagged]
+            flagged_task_time_left = tasks[14][flagged]
 
     percent_stolen = tasks_stolen / total_tasks if total_tasks > 0 else 0
     percent_flag_stolen = tasks_flag_stolen / total_tasks if total_tasks > 0 else 0
@@ -162,23 +202,21 @@ def analyze_sim_run(run_name, output_file, print_results=False, time_dropped=0):
     avg_flag_set_delay_time = total_flag_set_delay / total_flag_steals if total_flag_steals > 0 else 0
     avg_flag_set_delay_time_99 = total_flag_set_delay_999 / total_flag_steals_999 if total_flag_steals_999 > 0 else 0
 
-    avg_flagged_service_time = sum(flagged_task_service_times) / len(flagged_task_service_times) if len(flagged_task_service_times) > 0 else 0
-    avg_flagged_time_left = sum(flagged_task_time_left) / len(flagged_task_time_left) if len(flagged_task_time_left) > 0 else 0
+    avg_flagged_service_time = int(flagged_task_service_times.sum()) / len(flagged_task_service_times) if len(flagged_task_service_times) > 0 else 0
+    avg_flagged_time_left = int(flagged_task_time_left.sum()) / len(flagged_task_time_left) if len(flagged_task_time_left) > 0 else 0
     pct_flagged_queues_empty = len(flagged_task_service_times) / (stats["Empty Queues Flagged"] + len(flagged_task_service_times)) if (stats["Empty Queues Flagged"] + len(flagged_task_service_times)) > 0 else 0
 
     avg_time_from_alloc_to_task = stats["Total Alloc to Task Time"] / stats["Number Allocations"] if stats["Number Allocations"] > 0 else 0
 
-    data_string = "{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}".format(
-        run_name[4:], meta_data["num_threads"], meta_data["sim_duration"], meta_data["AVERAGE_SERVICE_TIME"],
+    return [
+        meta_data["num_threads"], meta_data["sim_duration"], meta_data["AVERAGE_SERVICE_TIME"],
         meta_data["avg_system_load"], avg_load * 100, avg_task_load * 100, avg_ws_load * 100, percentiles[0],
         percentiles[1], percentiles[2], percentiles[3], percent_stolen * 100, avg_steals, throughput, real_load * 100,
         (stats["Global Park Count"]/stats["End Time"]) * 10**9, successful_ws_time, unsuccessful_ws_time, non_work_conserving_time,
         allocation_time, task_time, distracted_time, unpaired_time, paired_time, avg_requeue_wait_time, flag_task_time, avg_time_from_alloc_to_task,
         avg_flag_steals_per_task, flag_steal_rate, flag_rate, percent_flag_stolen * 100, average_steals_per_flag,
         avg_core_flag_wait_time * 100, avg_task_flag_wait_time, avg_queueing_time, avg_core_flag_wait_time_99,
-        avg_flag_set_delay_time, avg_flag_set_delay_time_99, avg_flagged_service_time, avg_flagged_time_left, pct_flagged_queues_empty * 100,
-        "\"{}\"".format(meta_data["description"]))
-    output_file.write(data_string + "\n")
+        avg_flag_set_delay_time, avg_flag_set_delay_time_99, avg_flagged_service_time, avg_flagged_time_left, pct_flagged_queues_empty * 100]
 
 
 def main():
@@ -186,6 +224,13 @@ def main():
     # First arg is either a name of a file with a list of runs or the name of one run (or nothing to use entire results dir)
     # Second arg is output file
     # Third arg is how many of the first tasks to drop for task latency metrics
+    # Optional -workers <n> sets the number of processes used to analyze runs (default: number of CPUs)
+
+    workers = os.cpu_count()
+    if "-workers" in sys.argv:
+        index = sys.argv.index("-workers")
+        workers = int(sys.argv[index + 1])
+        del sys.argv[index:index + 2]
 
     if len(sys.argv) != 4:
         print("Invalid number of arguments.")
@@ -217,9 +262,25 @@ def main():
     else:
         print("File or directory not found")
 
+    # Only runs that changed since they were last analyzed are analyzed again, in parallel
+    time_dropped = int(sys.argv[-1])/100
+    sim_list = [sim_name.strip() for sim_name in sim_list]
+    summaries = {sim_name: cached_summary(sim_name, time_dropped) for sim_name in sim_list}
+    stale = [sim_name for sim_name in sim_list if summaries[sim_name] is None]
+    if len(stale) > 1 and workers > 1:
+        with multiprocessing.Pool(min(workers, len(stale))) as pool:
+            for sim_name, summary in zip(stale, pool.imap(summarize, [(x, time_dropped) for x in stale])):
+                summaries[sim_name] = summary
+                print("Simulation {} analysis complete".format(sim_name))
+    else:
+        for sim_name in stale:
+            summaries[sim_name] = run_summary(sim_name, time_dropped)
+            print("Simulation {} analysis complete".format(sim_name))
+    print("{} of {} simulations were unchanged since they were last analyzed".format(len(sim_list) - len(stale),
+                                                                                     len(sim_list)))
+
     for sim_name in sim_list:
-        analyze_sim_run(sim_name.strip(), output_file, time_dropped=int(sys.argv[-1])/100)
-        print("Simulation {} analysis complete".format(sim_name))
+        write_summary(sim_name, summaries[sim_name], output_file)
 
     output_file.close()
 
@@ -2,6 +2,9 @@ import shutil
 import sys
 import os
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "sim"))
+from run_index import remove_runs
+
 RESULTS_DIR_NAME = "./results/"
 RESULTS_SUBDIR_NAME = RESULTS_DIR_NAME + "{}/"
 META_LOG_PATH = RESULTS_DIR_NAME + "meta_log"
@@ -29,3 +32,5 @@ with open(META_LOG_PATH, "w") as f:
     for line in lines:
         if not(run_name in line):
             f.write(line)
+
+print("Removed %d runs from the run index" % remove_runs(RESULTS_DIR_NAME, run_name))
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""Lazy source of task arrivals for the simulation."""
+
+import hashlib
+import random
+
+from tasks import Task
+from distributions import make_distribution
+from record_file import read_records
+
+
+class TaskArrivals:
+    """Generates tasks as simulated time reaches them rather than creating the whole workload up front.
+    The next task is always generated one ahead so that its arrival time is known to the simulation.
+    """
+
+    BIMODAL_DISTRIBUTION = [500] * 9 + [5500]
+
+    def __init__(self, config, state, seed):
+        self.config = config
+        self.state = state
+        self.random = random.Random(seed)
+        self.init_service_times()
+        self.generated = 0
+
+        self.next_task_time = int(1 / self.request_rate) if config.regular_arrivals \
+            else int(self.random.expovariate(self.request_rate))
+        self.next_task = self.generate()
+
+    def init_service_times(self):
+        """Set up the configured service time distribution (if any) and the arrival rate that gives the configured
+        load."""
+        self.service_distribution = None
+        mean_service_time = self.config.AVERAGE_SERVICE_TIME
+        if self.config.service_time_distribution is not None:
+            self.service_distribution = make_distribution(self.config.service_time_distribution)
+            mean_service_time = self.service_distribution.mean()
+        self.request_rate = self.config.avg_system_load * self.config.load_thread_count / mean_service_time
+
+    def generate(self):
+        """Create the next task, or return None if the workload is over (duration passed or enough tasks created)."""
+        if (self.config.sim_duration is not None and self.next_task_time >= self.config.sim_duration) or \
+                (self.config.num_tasks is not None and self.generated >= self.config.num_tasks):
+            return None
+
+        service_time = None
+        while service_time is None or service_time == 0:
+            if self.config.constant_service_time:
+                service_time = self.config.AVERAGE_SERVICE_TIME
+            elif self.service_distribution is not None:
+                service_time = self.service_distribution.sample(self.random)
+            elif self.config.bimodal_service_time:
+                service_time = self.random.choice(self.BIMODAL_DISTRIBUTION)
+            else:
+                service_time = int(self.random.expovariate(1 / self.config.AVERAGE_SERVICE_TIME))
+
+        task = Task(service_time, self.next_task_time, self.config, self.state)
+        if self.config.regular_arrivals:
+            self.next_task_time += int(1 / self.request_rate)
+        else:
+            self.next_task_time += int(self.random.expovariate(self.request_rate))
+
+        self.generated += 1
+        return task
+
+    def next_arrival_time(self):
+        """Return the arrival time of the next task or None if there are no more tasks."""
+        return self.next_task.arrival_time if self.next_task is not None else None
+
+    def pop(self):
+        """Return the next task and generate the one after it."""
+        task = self.next_task
+        self.next_task = self.generate()
+        return task
+
+    def exhausted(self):
+        """Return true if every task in the workload has arrived."""
+        return self.next_task is None
+
+
+def numpy_generator(seed):
+    """Return a NumPy random generator for a seed. Text seeds (ex. run names) are mapped to the integer value of their
+    SHA-256 digest, so that the same seed always gives the same workload.
+    """
+    import numpy as np  # Only needed for vectorized workloads
+
+    if not isinstance(seed, int):
+        seed = int.from_bytes(hashlib.sha256(str(seed).encode()).digest(), "big")
+    return np.random.default_rng(seed)
+
+
+class VectorizedTaskArrivals(TaskArrivals):
+    """Generates the same kinds of workloads as TaskArrivals, but draws arrival and service times with NumPy in blocks
+    rather than one task at a time. Each block draws the gaps between arrivals for BLOCK_SIZE tasks, then their service
+    times, then replacements for any zero service times, so a workload depends only on its seed.
+    """
+
+    BLOCK_SIZE = 1 << 16
+
+    def __init__(self, config, state, seed):
+        self.config = config
+        self.state = state
+        self.random = numpy_generator(seed)
+        self.init_service_times()
+        self.generated = 0
+
+        # Arrival time of the last task drawn so far and the drawn tasks (arrival and service time pairs) not yet used
+        self.last_arrival_time = 0
+        self.block = []
+        self.block_index = 0
+
+        self.next_task = self.generate()
+
+    def draw_block(self):
+        """Draw the arrival and service times of the next block of tasks."""
+        import numpy as np  # Only needed for vectorized workloads
+
+        if self.config.regular_arrivals:
+            gaps = np.full(self.BLOCK_SIZE, int(1 / self.request_rate), dtype="<i8")
+        else:
+            gaps = self.random.exponential(1 / self.request_rate, self.BLOCK_SIZE).astype("<i8")
+        arrival_times = gaps.cumsum() + self.last_arrival_time
+        self.last_arrival_time = int(arrival_times[-1])
+
+        self.block = list(zip(arrival_times.tolist(), self.draw_service_times(self.BLOCK_SIZE).tolist()))
+        self.block_index = 0
+
+    def draw_service_times(self, count):
+        """Return an array of non-zero service times."""
+        import numpy as np  # Only needed for vectorized workloads
+
+        if self.config.constant_service_time:
+            return np.full(count, self.config.AVERAGE_SERVICE_TIME, dtype="<i8")
+
+        service_times = self.sample_service_times(count)
+        zeros = np.flatnonzero(service_times == 0)
+        while len(zeros) > 0:
+            service_times[zeros] = self.sample_service_times(len(zeros))
+            zeros = zeros[service_times[zeros] == 0]
+        return service_times
+
+    def sample_service_times(self, count):
+        """Return an array of service times drawn from the configured distribution."""
+        if self.service_distribution is not None:
+            return self.service_distribution.sample_batch(self.random, count)
+        elif self.config.bimodal_service_time:
+            return self.random.choice(self.BIMODAL_DISTRIBUTION, count)
+        return self.random.exponential(self.config.AVERAGE_SERVICE_TIME, count).astype("<i8")
+
+    def generate(self):
+        """Create the next task, or return None if the workload is over (duration passed or enough tasks created)."""
+        if self.config.num_tasks is not None and self.generated >= self.config.num_tasks:
+            return None
+
+        if self.block_index >= len(self.block):
+            self.draw_block()
+        arrival_time, service_time = self.block[self.block_index]
+        if self.config.sim_duration is not None and arrival_time >= self.config.sim_duration:
+            return None
+
+        self.block_index += 1
+        self.generated += 1
+        return Task(service_time, arrival_time, self.config, self.state)
+
+
+def load_trace(file_path):
+    """Return the arrival time and service time columns of a workload trace file without loading them into memory.
+    Traces are record files (ex. written with write_record_file) or NumPy .npy files of two columns, and the first two
+    columns are used.
+    """
+    import numpy as np  # Only needed to replay traces
+
+    trace = np.load(file_path, mmap_mode="r") if file_path.endswith(".npy") else read_records(file_path)
+    if trace.dtype.names is not None and len(trace.dtype.names) >= 2:
+        return trace[trace.dtype.names[0]], trace[trace.dtype.names[1]]
+    if trace.ndim == 2 and trace.shape[1] >= 2:
+        return trace[:, 0], trace[:, 1]
+    raise ValueError("Workload trace {} does not have arrival and service time columns".format(file_path))
+
+
+class TraceArrivals(TaskArrivals):
+    """Replays the tasks of a workload trace file, reading it a chunk at a time as simulated time reaches them.
+    Arrival times (which must be sorted) are shifted so that the start of the trace window is time 0, then scaled so
+    that the trace offers the configured system load.
+    """
+
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, config, state):
+        self.config = config
+        self.state = state
+        self.generated = 0
+        self.chunk = []
+        self.chunk_start = 0
+        self.open_trace()
+
+        # Tasks are read from the first arrival in the window up to (not including) the end index
+        self.start_time = config.workload_trace_start
+        if self.start_time is None:
+            self.start_time = int(self.arrival_times[0]) if len(self.arrival_times) > 0 else 0
+        self.position = int(self.arrival_times.searchsorted(self.start_time))
+        self.end_index = len(self.arrival_times) if config.workload_trace_end is None else \
+            int(self.arrival_times.searchsorted(config.workload_trace_end))
+        self.scale = self.load_scale()
+
+        self.next_task = self.generate()
+
+    def open_trace(self):
+        """Memory-map the trace file."""
+        self.arrival_times, self.service_times = load_trace(self.config.workload_trace)
+
+    def load_scale(self):
+        """Return the factor by which to stretch arrival times so that the trace offers the configured load (1 if no load
+        is configured or the window is empty)."""
+        if self.config.avg_system_load is None or self.position >= self.end_index:
+            return 1
+        end_time = self.config.workload_trace_end if self.config.workload_trace_end is not None \
+            else int(self.arrival_times[self.end_index - 1]) + 1
+        total_service_time = int(self.service_times[self.position:self.end_index].sum(dtype="<i8"))
+        if total_service_time == 0 or end_time <= self.start_time:
+            return 1
+        trace_load = total_service_time / (end_time - self.start_time)
+        return trace_load / (self.config.avg_system_load * self.config.load_thread_count)
+
+    def generate(self):
+        """Create the next task from the trace, or return None if the workload is over (end of the window reached,
+        duration passed or enough tasks created)."""
+        if self.position >= self.end_index or \
+                (self.config.num_tasks is not None and self.generated >= self.config.num_tasks):
+            return None
+
+        # Read the next chunk of the trace, converting arrival times to simulated time
+        if self.position - self.chunk_start >= len(self.chunk):
+            end = min(self.position + self.CHUNK_SIZE, self.end_index)
+            arrival_times = self.arrival_times[self.position:end] - self.start_time
+            if self.scale != 1:
+                arrival_times = arrival_times * self.scale
+            self.chunk = list(zip(arrival_times.astype("<i8").tolist(),
+                                  self.service_times[self.position:end].astype("<i8").tolist()))
+            self.chunk_start = self.position
+
+        arrival_time, service_time = self.chunk[self.position - self.chunk_start]
+        if self.config.sim_duration is not None and arrival_time >= self.config.sim_duration:
+            return None
+
+        self.position += 1
+        self.generated += 1
+        # Tasks need some service time
+        return Task(max(service_time, 1), arrival_time, self.config, self.state)
+
+    def __getstate__(self):
+        """Save the replay as its position in the trace rather than a copy of the trace."""
+        checkpoint = self.__dict__.copy()
+        for key in ["arrival_times", "service_times", "chunk"]:
+            del checkpoint[key]
+        return checkpoint
+
+    def __setstate__(self, checkpoint):
+        """Memory-map the trace again and continue from the saved position."""
+        self.__dict__.update(checkpoint)
+        self.chunk = []
+        self.chunk_start = self.position
+        self.open_trace()
@@ -0,0 +1,56 @@
+from simulation import Simulation, RESULTS_DIR, META_LOG_FILE, CONFIG_LOG_DIR, SINGLE_THREAD_SIM_NAME_FORMAT
+from sim_config import SimConfig
+
+import sys
+import os
+from datetime import datetime
+import json
+import pathlib
+
+BRANCH_NAME_FORMAT = "{}_{}"
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4 or not os.path.isfile(sys.argv[1]) or not os.path.isfile(sys.argv[3]):
+        print("Usage: python3 branch_sim.py <config_file> <branch_time> <branch_file> <description (optional)>")
+        exit(1)
+
+    time = datetime.now().strftime("%y-%m-%d_%H:%M:%S")
+    run_name = SINGLE_THREAD_SIM_NAME_FORMAT.format(os.uname().nodename, time)
+    path_to_sim = os.path.relpath(pathlib.Path(__file__).resolve().parents[1], start=os.curdir)
+    branch_time = int(sys.argv[2])
+
+    cfg_json_fp = open(sys.argv[1], "r")
+    cfg_json = cfg_json_fp.read()
+    cfg_json_fp.close()
+    cfg = json.loads(cfg_json, object_hook=SimConfig.decode_object)
+    cfg.name = run_name
+
+    # Branch file maps each branch suffix to the parameters it changes, ex. {"base": {}, "dt": {"DELAY_THRESHOLD": 5000}}
+    branch_fp = open(sys.argv[3], "r")
+    branches = {BRANCH_NAME_FORMAT.format(run_name, suffix): changes
+                for suffix, changes in json.load(branch_fp).items()}
+    branch_fp.close()
+
+    if len(sys.argv) > 4:
+        if not os.path.isdir(RESULTS_DIR.format(path_to_sim)):
+            os.makedirs(RESULTS_DIR.format(path_to_sim))
+        meta_log = open(META_LOG_FILE.format(path_to_sim), "a")
+        for name in branches.keys():
+            meta_log.write("{}: {}\n".format(name, sys.argv[4]))
+        meta_log.close()
+        cfg.description = sys.argv[4]
+
+    sim = Simulation(cfg, path_to_sim)
+    if sim.run(stop_time=branch_time):
+        for name, exit_code in sim.branch(branches).items():
+            print("Branch {} {}".format(name, "finished" if exit_code == 0 else "failed ({})".format(exit_code)))
+    else:
+        print("Simulation ended before the branch time, saving results as {}".format(run_name))
+        sim.save_stats()
+
+    if not(os.path.isdir(CONFIG_LOG_DIR.format(path_to_sim))):
+        os.makedirs(CONFIG_LOG_DIR.format(path_to_sim))
+    config_record = open(CONFIG_LOG_DIR.format(path_to_sim) + run_name + ".json", "w")
+    config_record.write(cfg_json)
+    config_record.close()
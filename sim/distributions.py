@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""Service time distributions, sampled one value at a time with a random.Random or in batches with a NumPy generator."""
+
+import math
+
+
+class EmpiricalDistribution:
+    """Distribution over a fixed set of values (ex. the buckets of a measured histogram), sampled in constant time with
+    a Walker alias table.
+    """
+
+    def __init__(self, values, weights=None):
+        """
+        :param values: Possible values
+        :param weights: Relative probability of each value (equal if not given)
+        """
+        if weights is None:
+            weights = [1] * len(values)
+        if len(values) == 0 or len(values) != len(weights):
+            raise ValueError("An empirical distribution needs one weight per value")
+        if any(x < 0 for x in weights) or sum(weights) <= 0:
+            raise ValueError("Empirical distribution weights must be non-negative and not all zero")
+
+        self.values = list(values)
+        self.weights = list(weights)
+        self.probabilities, self.aliases = self.build_alias_table(self.weights)
+        self.arrays = None
+
+    @staticmethod
+    def build_alias_table(weights):
+        """Return the probability of keeping each column of the table and the value to use otherwise (Vose's method)."""
+        count = len(weights)
+        total = sum(weights)
+        scaled = [weight * count / total for weight in weights]
+        probabilities = [1.0] * count
+        aliases = list(range(count))
+
+        small = [i for i in range(count) if scaled[i] < 1]
+        large = [i for i in range(count) if scaled[i] >= 1]
+        while len(small) > 0 and len(large) > 0:
+            less = small.pop()
+            more = large.pop()
+            probabilities[less] = scaled[less]
+            aliases[less] = more
+            scaled[more] -= 1 - scaled[less]
+            if scaled[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+        # Anything left over is only off from 1 by rounding error, so it keeps its own column
+        return probabilities, aliases
+
+    def sample(self, random):
+        """Draw a value."""
+        position = random.random() * len(self.values)
+        column = int(position)
+        return self.values[column] if position - column < self.probabilities[column] else \
+            self.values[self.aliases[column]]
+
+    def sample_batch(self, generator, count):
+        """Draw an array of values."""
+        import numpy as np  # Only needed for batches
+
+        if self.arrays is None:
+            self.arrays = np.array(self.values), np.array(self.probabilities), np.array(self.aliases)
+        values, probabilities, aliases = self.arrays
+        positions = generator.random(count) * len(values)
+        columns = positions.astype(np.int64)
+        return np.where(positions - columns < probabilities[columns], values[columns], values[aliases[columns]])
+
+    def mean(self):
+        """Return the mean of the distribution."""
+        return sum(value * weight for value, weight in zip(self.values, self.weights)) / sum(self.weights)
+
+
+class LognormalDistribution:
+    """Lognormal distribution given by its mean and the standard deviation of its logarithm."""
+
+    def __init__(self, mean, sigma):
+        if mean <= 0 or sigma < 0:
+            raise ValueError("A lognormal distribution needs a positive mean and a non-negative sigma")
+        self.mean_value = mean
+        self.sigma = sigma
+        self.mu = math.log(mean) - sigma ** 2 / 2
+
+    def sample(self, random):
+        """Draw a value."""
+        return int(random.lognormvariate(self.mu, self.sigma))
+
+    def sample_batch(self, generator, count):
+        """Draw an array of values."""
+        return generator.lognormal(self.mu, self.sigma, count).astype("<i8")
+
+    def mean(self):
+        """Return the mean of the distribution."""
+        return self.mean_value
+
+
+class BoundedParetoDistribution:
+    """Pareto distribution with shape alpha, truncated to the range [low, high]."""
+
+    def __init__(self, alpha, low, high):
+        if alpha <= 0 or not 0 < low < high:
+            raise ValueError("A bounded Pareto distribution needs a positive alpha and 0 < low < high")
+        self.alpha = alpha
+        self.low = low
+        self.high = high
+        # Fraction of the unbounded distribution's probability below the upper bound
+        self.range = 1 - (low / high) ** alpha
+
+    def sample(self, random):
+        """Draw a value (by inverting the distribution function)."""
+        return int(self.low / (1 - random.random() * self.range) ** (1 / self.alpha))
+
+    def sample_batch(self, generator, count):
+        """Draw an array of values."""
+        return (self.low / (1 - generator.random(count) * self.range) ** (1 / self.alpha)).astype("<i8")
+
+    def mean(self):
+        """Return the mean of the distribution."""
+        if self.alpha == 1:
+            return self.high * self.low / (self.high - self.low) * math.log(self.high / self.low)
+        return self.low ** self.alpha / self.range * self.alpha / (self.alpha - 1) * \
+            (self.low ** (1 - self.alpha) - self.high ** (1 - self.alpha))
+
+
+def make_distribution(specification):
+    """Create a distribution from its configuration, a dictionary with a type and its parameters:
+    {"type": "empirical", "values": [...], "weights": [...]}, {"type": "lognormal", "mean": ..., "sigma": ...} or
+    {"type": "bounded_pareto", "alpha": ..., "low": ..., "high": ...}
+    """
+    parameters = dict(specification)
+    distribution_type = parameters.pop("type", None)
+    if distribution_type == "empirical":
+        return EmpiricalDistribution(**parameters)
+    elif distribution_type == "lognormal":
+        return LognormalDistribution(**parameters)
+    elif distribution_type == "bounded_pareto":
+        return BoundedParetoDistribution(**parameters)
+    raise ValueError("Unknown distribution type {}".format(distribution_type))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Priority queue of upcoming simulation events."""
+
+import heapq
+
+
+class EventQueue:
+    """Min-heap of event times keyed by the object they belong to (ex. thread or queue id).
+    Each key has at most one live event. Updating a key pushes a new entry and stale entries are discarded lazily when
+    they reach the top of the heap.
+    """
+
+    # Rebuild the heap when stale entries outnumber live ones by this factor
+    COMPACTION_FACTOR = 4
+
+    def __init__(self):
+        self.heap = []
+        self.times = {}
+
+    def update(self, key, time):
+        """Set the time of the event for the given key.
+        :param key: Identifier of the event owner.
+        :param time: Time of the event. If None, the event is removed.
+        """
+        if time is None:
+            self.times.pop(key, None)
+            return
+        if self.times.get(key) == time:
+            return
+
+        self.times[key] = time
+        heapq.heappush(self.heap, (time, key))
+
+        if len(self.heap) > self.COMPACTION_FACTOR * len(self.times) + 64:
+            self.compact()
+
+    def remove(self, key):
+        """Remove the event for the given key if there is one."""
+        self.times.pop(key, None)
+
+    def get(self, key):
+        """Return the time of the event for the given key or None if there is none."""
+        return self.times.get(key)
+
+    def peek(self, exclude=None):
+        """Return the (time, key) pair of the earliest event or None if there are no events.
+        :param exclude: If given, skip the event of this key.
+        """
+        skipped = []
+        event = None
+        while len(self.heap) > 0:
+            time, key = self.heap[0]
+            if self.times.get(key) != time:
+                heapq.heappop(self.heap)
+            elif key == exclude:
+                skipped.append(heapq.heappop(self.heap))
+            else:
+                event = (time, key)
+                break
+        for entry in skipped:
+            heapq.heappush(self.heap, entry)
+        return event
+
+    def next_time(self):
+        """Return the time of the earliest event or None if there are no events."""
+        event = self.peek()
+        return event[0] if event is not None else None
+
+    def compact(self):
+        """Drop all stale entries from the heap."""
+        self.heap = [(time, key) for key, time in self.times.items()]
+        heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.times)
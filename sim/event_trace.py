@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Binary trace of simulation events."""
+
+import struct
+import sys
+from collections import namedtuple
+
+TRACE_FILE = "trace.bin"
+
+# Each event is the time, event type, acting thread, target (queue or thread) and a value, little-endian
+RECORD = struct.Struct("<qBhhq")
+
+# Event types (target, value)
+ARRIVAL = 0             # queue the task was placed on, service time
+WORK_STEAL = 1          # queue stolen from, number of tasks stolen
+FLAG_RAISE = 2          # thread flagged, delay from crossing the threshold to raising the flag
+FLAG_STEAL = 3          # queue stolen from, number of tasks stolen
+FLAG_STEAL_FAILED = 4   # queue that could not be stolen from, 0
+PARK = 5                # queue of the thread, 0
+ALLOCATE = 6            # queue of the thread, 0
+COMPLETION = 7          # original queue of the task, time in system
+
+EVENT_NAMES = ["Arrival", "Work Steal", "Flag Raise", "Flag Steal", "Flag Steal Failed", "Park", "Allocate",
+               "Completion"]
+
+TraceEvent = namedtuple("TraceEvent", ["time", "event", "thread", "target", "value"])
+
+
+class EventTrace:
+    """Writes fixed-size binary event records to the trace file, buffering them in memory between writes."""
+
+    BUFFER_SIZE = 1 << 16
+
+    def __init__(self, file_path, timer):
+        self.file_path = file_path
+        self.file = open(file_path, "wb")
+        self.timer = timer
+        self.buffer = bytearray()
+        self.event_count = 0
+
+    def record(self, event, thread_id=-1, target=-1, value=0):
+        """Record an event at the current time.
+        :param event: Event type
+        :param thread_id: ID of the thread the event happened on (-1 if none)
+        :param target: ID of the queue or thread the event acted on (-1 if none)
+        :param value: Event-specific value
+        """
+        self.buffer += RECORD.pack(self.timer.get_time(), event, thread_id, target, value)
+        self.event_count += 1
+        if len(self.buffer) >= self.BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Write buffered events to the file."""
+        self.file.write(self.buffer)
+        self.file.flush()
+        self.buffer = bytearray()
+
+    def close(self):
+        """Write any remaining events and close the file."""
+        self.flush()
+        self.file.close()
+
+    def copy_to(self, file_path):
+        """Copy the events written so far to a new file and continue writing there. The trace must be flushed first."""
+        offset = self.file.tell()
+        self.file.close()
+        with open(self.file_path, "rb") as source, open(file_path, "wb") as copy:
+            copy.write(source.read(offset))
+
+        self.file_path = file_path
+        self.file = open(file_path, "ab")
+
+    def __getstate__(self):
+        """Save the trace as the position in the file it has written up to. The trace must be flushed first."""
+        return {"file_path": self.file_path, "timer": self.timer, "event_count": self.event_count,
+                "offset": self.file.tell()}
+
+    def __setstate__(self, checkpoint):
+        """Reopen the file, dropping any events written after the checkpoint."""
+        self.file_path = checkpoint["file_path"]
+        self.timer = checkpoint["timer"]
+        self.event_count = checkpoint["event_count"]
+        self.buffer = bytearray()
+
+        self.file = open(self.file_path, "r+b")
+        self.file.truncate(checkpoint["offset"])
+        self.file.seek(checkpoint["offset"])
+
+
+def read_trace(file_path, chunk_records=4096):
+    """Yield the events of a trace file in order."""
+    with open(file_path, "rb") as trace_file:
+        while True:
+            chunk = trace_file.read(RECORD.size * chunk_records)
+            if len(chunk) == 0:
+                break
+            for fields in RECORD.iter_unpack(chunk):
+                yield TraceEvent(*fields)
+
+
+def format_event(event):
+    """Return a readable line for an event."""
+    return "{}: {} (thread {}, target {}, value {})".format(event.time, EVENT_NAMES[event.event], event.thread,
+                                                           event.target, event.value)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python3 event_trace.py <trace file>")
+        exit(1)
+    for trace_event in read_trace(sys.argv[1]):
+        print(format_event(trace_event))
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""Index of threads that can be flagged to help a loaded queue."""
+
+from collections.abc import Sequence
+
+from event_queue import EventQueue
+
+
+class ThreadIdSet:
+    """Set of thread IDs kept in ID order that supports finding the k-th smallest member (Fenwick tree)."""
+
+    __slots__ = ("size", "tree", "members", "count", "top_step")
+
+    def __init__(self, size):
+        self.size = size
+        self.tree = [0] * (size + 1)
+        self.members = [False] * size
+        self.count = 0
+        self.top_step = 1 << (size.bit_length() - 1) if size > 0 else 0
+
+    def add(self, thread_id):
+        """Add a thread ID to the set."""
+        if not self.members[thread_id]:
+            self.members[thread_id] = True
+            self.count += 1
+            self.update_tree(thread_id, 1)
+
+    def discard(self, thread_id):
+        """Remove a thread ID from the set if present."""
+        if self.members[thread_id]:
+            self.members[thread_id] = False
+            self.count -= 1
+            self.update_tree(thread_id, -1)
+
+    def update_tree(self, thread_id, change):
+        """Add the change to the counts of the tree nodes covering the thread ID."""
+        i = thread_id + 1
+        while i <= self.size:
+            self.tree[i] += change
+            i += i & -i
+
+    def rank(self, thread_id):
+        """Return the number of members smaller than the thread ID."""
+        total = 0
+        i = thread_id
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def kth(self, k):
+        """Return the k-th smallest member (starting from 0)."""
+        position = 0
+        remaining = k + 1
+        step = self.top_step
+        while step > 0:
+            if position + step <= self.size and self.tree[position + step] < remaining:
+                position += step
+                remaining -= self.tree[position]
+            step >>= 1
+        return position
+
+    def __contains__(self, thread_id):
+        return self.members[thread_id]
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return (i for i in range(self.size) if self.members[i])
+
+
+class HelperOptions(Sequence):
+    """Read-only view of the flaggable threads in ID order, leaving out the flagging thread.
+    Equivalent to the list of thread IDs built by scanning all threads, so it can be passed to random.choice and
+    random.sample directly.
+    """
+
+    def __init__(self, helpers, exclude):
+        self.helpers = helpers
+        self.exclude = exclude
+        self.skip = helpers.rank(exclude) if exclude in helpers else None
+
+    def __len__(self):
+        return len(self.helpers) - (1 if self.skip is not None else 0)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("helper option index out of range")
+        if self.skip is not None and index >= self.skip:
+            index += 1
+        return self.helpers.kth(index)
+
+    def __iter__(self):
+        return (x for x in self.helpers if x != self.exclude)
+
+
+class FlagHelperIndex:
+    """Threads that can be flagged for help (not already flagged and not parked or allocating).
+    For ideal flag stealing, helpers are also ordered by the queueing delay of the second task in their queue.
+    """
+
+    def __init__(self, num_threads, ideal):
+        self.helpers = ThreadIdSet(num_threads)
+        self.ideal = ideal
+
+        # Helpers with fewer than two queued tasks (delay of 0), ordered by ID
+        self.short_queues = EventQueue()
+        # Helpers with a second task, ordered by latest second task arrival (shortest delay) then ID
+        self.second_arrivals = EventQueue()
+
+    def update(self, thread):
+        """Update the index after the flag, work search state or queue of a thread changes."""
+        is_helper = thread.work_steal_flag is None and thread.work_search_state.is_active()
+        if is_helper:
+            self.helpers.add(thread.id)
+        else:
+            self.helpers.discard(thread.id)
+
+        if self.ideal:
+            second = thread.queue.second()
+            self.short_queues.update(thread.id, 0 if is_helper and second is None else None)
+            self.second_arrivals.update(thread.id, -second.arrival_time if is_helper and second is not None else None)
+
+    def options(self, exclude):
+        """Return the IDs of all helpers other than the given thread in ID order."""
+        return HelperOptions(self.helpers, exclude)
+
+    def least_delayed(self, current_time):
+        """Return (second task delay, thread ID) of the helper with the shortest delay (lowest ID on ties) or None."""
+        candidates = []
+        short = self.short_queues.peek()
+        if short is not None:
+            candidates.append((0, short[1]))
+        second = self.second_arrivals.peek()
+        if second is not None:
+            candidates.append((current_time + second[0], second[1]))
+        return min(candidates) if len(candidates) > 0 else None
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""Log-bucketed latency histograms that can be merged across runs."""
+
+import json
+import math
+import os
+import sys
+
+HISTOGRAM_FILE = "latency_histograms.json"
+
+# Values below 2^SUB_BUCKET_BITS are recorded exactly, larger values with a relative error of at most 2^-(bits - 1)
+SUB_BUCKET_BITS = 8
+
+
+class LatencyHistogram:
+    """HDR-style histogram of latencies. Each power of two range is split into a fixed number of linear buckets, so the
+    relative error of any percentile is bounded regardless of the range of values.
+    """
+
+    def __init__(self, sub_bucket_bits=SUB_BUCKET_BITS):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.half_count = self.sub_bucket_count >> 1
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def bucket_index(self, value):
+        """Return the index of the bucket holding a (non-negative) value."""
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self.sub_bucket_count + (shift - 1) * self.half_count + (value >> shift) - self.half_count
+
+    def bucket_range(self, index):
+        """Return the lowest and highest values held by a bucket."""
+        if index < self.sub_bucket_count:
+            return index, index
+        shift = (index - self.sub_bucket_count) // self.half_count + 1
+        mantissa = (index - self.sub_bucket_count) % self.half_count + self.half_count
+        return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+    def record(self, value, count=1):
+        """Add a value to the histogram."""
+        index = self.bucket_index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Add the values of another histogram with the same precision to this one."""
+        if other.sub_bucket_bits != self.sub_bucket_bits:
+            raise ValueError("Cannot merge histograms with different precisions")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, percentile):
+        """Return the highest value equivalent (within the precision) to the given percentile, or None if empty."""
+        if self.count == 0:
+            return None
+        rank = max(1, math.ceil(percentile / 100 * self.count))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.bucket_range(index)[1], self.max)
+        return self.max
+
+    def mean(self):
+        """Return the mean of the recorded values, or None if empty."""
+        return self.total / self.count if self.count > 0 else None
+
+    def to_dict(self):
+        """Return a compact serializable form of the histogram (only non-empty buckets are kept)."""
+        indices = sorted(self.buckets)
+        return {"sub_bucket_bits": self.sub_bucket_bits, "count": self.count, "total": self.total, "min": self.min,
+                "max": self.max, "indices": indices, "counts": [self.buckets[i] for i in indices]}
+
+    @staticmethod
+    def from_dict(data):
+        """Recreate a histogram from its serialized form."""
+        histogram = LatencyHistogram(data["sub_bucket_bits"])
+        histogram.buckets = dict(zip(data["indices"], data["counts"]))
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
+
+
+class LatencyRecorder:
+    """Records the latency of completed tasks, overall (after the warm-up) and per window of arrival times."""
+
+    def __init__(self, warmup_time, window):
+        """
+        :param warmup_time: Tasks arriving at or before this time are left out of the overall histogram
+        :param window: Length of the arrival time windows in ns (None for no windows)
+        """
+        self.warmup_time = warmup_time
+        self.window = window
+        self.overall = LatencyHistogram()
+        self.windows = {}
+
+    def record(self, arrival_time, latency):
+        """Record the latency of a task."""
+        if arrival_time > self.warmup_time:
+            self.overall.record(latency)
+        if self.window is not None:
+            start = arrival_time - arrival_time % self.window
+            if start not in self.windows:
+                self.windows[start] = LatencyHistogram()
+            self.windows[start].record(latency)
+
+    def save(self, file_path):
+        """Write the histograms to a file."""
+        histogram_file = open(file_path, "w")
+        json.dump({"warmup_time": self.warmup_time, "window": self.window, "overall": self.overall.to_dict(),
+                   "windows": [[start, self.windows[start].to_dict()] for start in sorted(self.windows)]},
+                  histogram_file)
+        histogram_file.close()
+
+
+def load_histograms(file_path):
+    """Return the overall histogram and the list of (window start, histogram) pairs saved in a file."""
+    histogram_file = open(file_path, "r")
+    data = json.load(histogram_file)
+    histogram_file.close()
+    return LatencyHistogram.from_dict(data["overall"]), \
+        [(start, LatencyHistogram.from_dict(window)) for start, window in data["windows"]]
+
+
+def merge_histograms(histograms):
+    """Return a new histogram with the values of all given histograms."""
+    merged = LatencyHistogram()
+    for histogram in histograms:
+        merged.merge(histogram)
+    return merged
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python3 latency_histogram.py <results directory or histogram file> ...")
+        exit(1)
+
+    overall = []
+    for path in sys.argv[1:]:
+        overall.append(load_histograms(os.path.join(path, HISTOGRAM_FILE) if os.path.isdir(path) else path)[0])
+    merged = merge_histograms(overall)
+    print("Tasks: {}".format(merged.count))
+    print("Mean Latency: {}".format(merged.mean()))
+    for p in [50, 95, 99, 99.9]:
+        print("{}% Latency: {}".format(p, merged.percentile(p)))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Wall-clock timing of the phases of the simulation loop."""
+
+import json
+import time
+
+PROFILE_FILE = "profile.json"
+
+# Phases of a loop iteration
+CHECKPOINT = "Checkpoint"
+FIND_TIME_JUMP = "Find Time Jump"
+ARRIVALS = "Arrivals"
+REALLOCATION = "Reallocation"
+SCHEDULE = "Thread Schedule"
+DETERMINE_PAIRINGS = "Determine Pairings"
+PHASES = [CHECKPOINT, FIND_TIME_JUMP, ARRIVALS, REALLOCATION, SCHEDULE, DETERMINE_PAIRINGS]
+
+
+class PhaseProfiler:
+    """Accumulates the wall-clock time and number of calls of each phase, and the progress of the simulation loop.
+    Phases are timed back to back: add() returns the time it was called so that it can start the next phase.
+    """
+
+    def __init__(self):
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.loop_iterations = 0
+        self.wall_time = 0.0
+        self.loop_start = None
+        self.start_time = None
+
+    @staticmethod
+    def now():
+        """Return the current wall-clock time to start timing a phase."""
+        return time.perf_counter()
+
+    def add(self, phase, start):
+        """Add the time since the start to a phase and return the current time."""
+        end = time.perf_counter()
+        self.times[phase] += end - start
+        self.calls[phase] += 1
+        return end
+
+    def start_loop(self, simulated_time):
+        """Start timing the simulation loop (ex. when starting or resuming the simulation)."""
+        if self.start_time is None:
+            self.start_time = simulated_time
+        self.loop_start = time.perf_counter()
+
+    def stop_loop(self):
+        """Stop timing the simulation loop."""
+        self.wall_time += time.perf_counter() - self.loop_start
+
+    def results(self, state):
+        """Return the profile of a simulation with its work and throughput."""
+        simulated_time = state.timer.get_time() - self.start_time if self.start_time is not None else 0
+        reallocations = state.park_count + state.allocations
+        events = state.tasks_scheduled + state.complete_task_count + reallocations
+        profile = {"Wall Time": self.wall_time, "Simulated Time": simulated_time,
+                   "Simulated ns per Wall Second": simulated_time / self.wall_time if self.wall_time > 0 else None,
+                   "Loop Iterations": self.loop_iterations, "Task Arrivals": state.tasks_scheduled,
+                   "Task Completions": state.complete_task_count, "Reallocations": reallocations,
+                   "Events Processed": events,
+                   "Events per Wall Second": events / self.wall_time if self.wall_time > 0 else None,
+                   "Phases": {}}
+        for phase in PHASES:
+            profile["Phases"][phase] = {
+                "Time": self.times[phase], "Calls": self.calls[phase],
+                "Fraction of Wall Time": self.times[phase] / self.wall_time if self.wall_time > 0 else None}
+        return profile
+
+    def save(self, file_path, state):
+        """Write the profile to a file."""
+        profile_file = open(file_path, "w")
+        json.dump(self.results(state), profile_file, indent=0)
+        profile_file.close()
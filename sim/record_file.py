@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""Binary results files of fixed-width integer records that can be memory-mapped as arrays."""
+
+import json
+import os
+import struct
+import sys
+from itertools import chain
+
+RECORD_FILE_EXTENSION = ".bin"
+MAGIC = b"SIMREC1\n"
+HEADER_LENGTH = struct.Struct("<I")
+
+# The first record starts at a multiple of this many bytes
+ALIGNMENT = 64
+
+# Column types (struct format characters, all little-endian)
+INT64 = "q"
+INT32 = "i"
+INT16 = "h"
+INT8 = "b"
+NUMPY_TYPES = {INT64: "<i8", INT32: "<i4", INT16: "<i2", INT8: "<i1"}
+
+# Written in place of values that are not set (None in the text form, ex. the original queue of a task still in the
+# main queue of a bounded queue run)
+MISSING_VALUE = -1
+
+
+def time_type(duration):
+    """Return the column type for times (in ns) of a run of the given duration (None if it is not limited). The last
+    time step of a run can pass its duration, so 32 bits are only used with the duration again as headroom."""
+    return INT32 if duration is not None and 2 * duration < 2 ** 31 else INT64
+
+
+class RecordFormat:
+    """Layout of the records of a file. Values that do not fit their column type raise a struct error."""
+
+    def __init__(self, columns, types=None, csv_header=True):
+        """
+        :param columns: Column names
+        :param types: Type of each column (64-bit integers if not given)
+        :param csv_header: Whether the text form of the file starts with a line of column names
+        """
+        self.columns = list(columns)
+        self.types = list(types) if types is not None else [INT64] * len(self.columns)
+        self.csv_header = csv_header
+
+    def write_header(self, file):
+        """Write the header describing the columns, padded so that the records are aligned."""
+        header = json.dumps({"columns": self.columns, "types": self.types, "csv_header": self.csv_header}).encode()
+        padding = -(len(MAGIC) + HEADER_LENGTH.size + len(header)) % ALIGNMENT
+        file.write(MAGIC + HEADER_LENGTH.pack(len(header) + padding) + header + b" " * padding)
+
+    def pack_rows(self, rows):
+        """Return the bytes of a list of rows of integers (None is written as MISSING_VALUE)."""
+        return struct.pack("<" + "".join(self.types) * len(rows),
+                           *[MISSING_VALUE if x is None else x for x in chain.from_iterable(rows)])
+
+
+def write_record_file(file_path, record_format, rows):
+    """Write a complete record file."""
+    record_file = open(file_path, "wb")
+    record_format.write_header(record_file)
+    record_file.write(record_format.pack_rows(rows))
+    record_file.close()
+
+
+class RecordWriter:
+    """Appends records to a file as they are produced, buffering them in memory between writes."""
+
+    BUFFER_SIZE = 1 << 16
+
+    def __init__(self, file_path, record_format):
+        self.file_path = file_path
+        self.record_format = record_format
+        self.record = struct.Struct("<" + "".join(record_format.types))
+        self.file = open(file_path, "wb")
+        record_format.write_header(self.file)
+        self.buffer = bytearray()
+
+    def add(self, values):
+        """Append a record (a sequence of integers, one per column)."""
+        self.buffer += self.record.pack(*values)
+        if len(self.buffer) >= self.BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Write buffered records to the file."""
+        self.file.write(self.buffer)
+        self.file.flush()
+        self.buffer = bytearray()
+
+    def close(self):
+        """Write any remaining records and close the file."""
+        self.flush()
+        self.file.close()
+
+    def copy_to(self, file_path):
+        """Copy the records written so far to a new file and continue writing there. The writer must be flushed
+        first."""
+        offset = self.file.tell()
+        self.file.close()
+        with open(self.file_path, "rb") as source, open(file_path, "wb") as copy:
+            copy.write(source.read(offset))
+
+        self.file_path = file_path
+        self.file = open(file_path, "ab")
+
+    def __getstate__(self):
+        """Save the writer as the position in the file it has written up to. The writer must be flushed first."""
+        return {"file_path": self.file_path, "record_format": self.record_format, "offset": self.file.tell()}
+
+    def __setstate__(self, checkpoint):
+        """Reopen the file, dropping any records written after the checkpoint."""
+        self.file_path = checkpoint["file_path"]
+        self.record_format = checkpoint["record_format"]
+        self.record = struct.Struct("<" + "".join(self.record_format.types))
+        self.buffer = bytearray()
+
+        self.file = open(self.file_path, "r+b")
+        self.file.truncate(checkpoint["offset"])
+        self.file.seek(checkpoint["offset"])
+
+
+class RecordCursor:
+    """Reads the records of a file in order a chunk at a time, so that the whole file is never held in memory."""
+
+    CHUNK_RECORDS = 4096
+
+    def __init__(self, file_path, position=0):
+        """
+        :param file_path: Record file to read
+        :param position: Index of the first record to read
+        """
+        self.file_path = file_path
+        self.file = open(file_path, "rb")
+        self.header, self.offset = read_header(self.file)
+        self.record = struct.Struct("<" + "".join(self.header["types"]))
+        self.count = (os.path.getsize(file_path) - self.offset) // self.record.size
+        self.position = position
+        self.chunk = []
+        self.chunk_start = position
+
+    def peek(self):
+        """Return the next record as a tuple without moving past it, or None if there are no more records."""
+        if self.position >= self.count:
+            return None
+        if self.position - self.chunk_start >= len(self.chunk):
+            # Reads give their offset explicitly, so a file shared with forked processes is read correctly
+            self.chunk = list(self.record.iter_unpack(os.pread(
+                self.file.fileno(), self.record.size * min(self.CHUNK_RECORDS, self.count - self.position),
+                self.offset + self.position * self.record.size)))
+            self.chunk_start = self.position
+        return self.chunk[self.position - self.chunk_start]
+
+    def advance(self):
+        """Move past the next record."""
+        self.position += 1
+
+    def __getstate__(self):
+        """Save the cursor as its position in the file."""
+        return {"file_path": self.file_path, "position": self.position}
+
+    def __setstate__(self, checkpoint):
+        """Reopen the file at the saved position."""
+        self.__init__(checkpoint["file_path"], checkpoint["position"])
+
+
+def read_header(record_file):
+    """Return the header of a record file and the offset of its first record."""
+    if record_file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a simulation record file")
+    length = HEADER_LENGTH.unpack(record_file.read(HEADER_LENGTH.size))[0]
+    return json.loads(record_file.read(length).decode()), len(MAGIC) + HEADER_LENGTH.size + length
+
+
+def read_records(file_path):
+    """Return the records of a file as a read-only memory-mapped NumPy array with one named field per column."""
+    import numpy as np  # Only needed to read results, not to run the simulator
+
+    with open(file_path, "rb") as record_file:
+        header, offset = read_header(record_file)
+    dtype = np.dtype([(column, NUMPY_TYPES[column_type])
+                      for column, column_type in zip(header["columns"], header["types"])])
+    # An empty file cannot be mapped
+    if os.path.getsize(file_path) == offset:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(file_path, dtype=dtype, mode="r", offset=offset)
+
+
+def export_csv(file_path, csv_path):
+    """Write the records of a file as CSV, as the simulator would have written them in text form (except that values
+    that were not set are MISSING_VALUE rather than None)."""
+    with open(file_path, "rb") as record_file, open(csv_path, "w") as csv_file:
+        header, offset = read_header(record_file)
+        record = struct.Struct("<" + "".join(header["types"]))
+        if header["csv_header"]:
+            csv_file.write(",".join(header["columns"]) + "\n")
+        while True:
+            chunk = record_file.read(record.size * 4096)
+            if len(chunk) == 0:
+                break
+            csv_file.write("".join([",".join([str(x) for x in values]) + "\n" for values in record.iter_unpack(chunk)]))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python3 record_file.py <record file> <csv file>")
+        exit(1)
+    export_csv(sys.argv[1], sys.argv[2])
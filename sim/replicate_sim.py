@@ -0,0 +1,136 @@
+"""Runs independent replicas of one configuration and reports the mean and confidence interval of each metric.
+Replicas are added in batches until the confidence interval of the 99.9% tail latency is narrow enough.
+"""
+
+from simulation import RESULTS_DIR, META_LOG_FILE, CONFIG_LOG_DIR, SINGLE_THREAD_SIM_NAME_FORMAT
+from sim_config import SimConfig
+from run_sim import SweepExecutor, SWEEP_DIR_FORMAT, pop_option
+
+import sys
+import os
+import math
+import statistics
+from datetime import datetime
+import json
+import pathlib
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from analysis import sim_run_metrics, METRIC_NAMES
+
+REPLICA_NAME_FORMAT = "{}_r{}"
+TARGET_METRIC = "99.9% Tail Latency"
+REPLICATE_CSV_HEADER = "Metric,Mean,CI Low,CI High,Relative Width,Replicas"
+
+
+def t_quantile(p, df):
+    """Return the p quantile of the Student's t distribution with df degrees of freedom.
+    Exact for one and two degrees of freedom, otherwise uses the Cornish-Fisher expansion (within 1% for p <= 0.995).
+    """
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) * math.sqrt(2 / (4 * p * (1 - p)))
+    z = statistics.NormalDist().inv_cdf(p)
+    return z + (z**3 + z) / (4 * df) + \
+        (5 * z**5 + 16 * z**3 + 3 * z) / (96 * df**2) + \
+        (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / (384 * df**3) + \
+        (79 * z**9 + 776 * z**7 + 1482 * z**5 - 1920 * z**3 - 945 * z) / (92160 * df**4)
+
+
+def confidence_interval(values, confidence):
+    """Return (mean, low, high) of the confidence interval for the mean of the values."""
+    mean = statistics.fmean(values)
+    if len(values) < 2:
+        return mean, mean, mean
+    half_width = t_quantile(0.5 + confidence / 2, len(values) - 1) * statistics.stdev(values) / math.sqrt(len(values))
+    return mean, mean - half_width, mean + half_width
+
+
+def relative_width(interval):
+    """Return the full width of a confidence interval relative to its mean (None if the mean is 0)."""
+    mean, low, high = interval
+    return (high - low) / abs(mean) if mean != 0 else None
+
+
+if __name__ == "__main__":
+    min_replicas = int(pop_option("-min", 5))
+    max_replicas = int(pop_option("-max", 50))
+    target_width = float(pop_option("-width", 0.05))
+    confidence = float(pop_option("-confidence", 0.95))
+    workers = int(pop_option("-workers", os.cpu_count()))
+    time_dropped = float(pop_option("-drop", 10)) / 100
+
+    if len(sys.argv) < 3 or not os.path.isfile(sys.argv[1]) or not 2 <= min_replicas <= max_replicas:
+        print("Usage: python3 replicate_sim.py <config_file> <output_file> <description (optional)> [-min replicas] "
+              "[-max replicas] [-width relative CI width] [-confidence level] [-workers count] [-drop percent]")
+        exit(1)
+
+    time = datetime.now().strftime("%y-%m-%d_%H:%M:%S")
+    run_name = SINGLE_THREAD_SIM_NAME_FORMAT.format(os.uname().nodename, time)
+    path_to_sim = os.path.relpath(pathlib.Path(__file__).resolve().parents[1], start=os.curdir)
+    description = sys.argv[3] if len(sys.argv) > 3 else ""
+
+    cfg_json_fp = open(sys.argv[1], "r")
+    cfg_json = cfg_json_fp.read()
+    cfg_json_fp.close()
+
+    if json.loads(cfg_json, object_hook=SimConfig.decode_object).reallocation_replay:
+        print("Replicas cannot replay a reallocation record since every replica would have the same seed")
+        exit(1)
+
+    if not(os.path.isdir(CONFIG_LOG_DIR.format(path_to_sim))):
+        os.makedirs(CONFIG_LOG_DIR.format(path_to_sim))
+    config_record = open(CONFIG_LOG_DIR.format(path_to_sim) + run_name + ".json", "w")
+    config_record.write(cfg_json)
+    config_record.close()
+
+    # Each replica is seeded by its name, so replicas are independent
+    completed = []
+    replica_count = 0
+    batch_size = min_replicas
+    while batch_size > 0:
+        jobs = []
+        for i in range(replica_count, replica_count + batch_size):
+            cfg = json.loads(cfg_json, object_hook=SimConfig.decode_object)
+            cfg.name = REPLICA_NAME_FORMAT.format(run_name, i)
+            cfg.description = description
+            cfg.progress_bar = (i == 0)
+            jobs.append((cfg.name, cfg))
+        replica_count += batch_size
+
+        if description:
+            if not os.path.isdir(RESULTS_DIR.format(path_to_sim)):
+                os.makedirs(RESULTS_DIR.format(path_to_sim))
+            meta_log = open(META_LOG_FILE.format(path_to_sim), "a")
+            for name, cfg in jobs:
+                meta_log.write("{}: {}\n".format(name, description))
+            meta_log.close()
+
+        executor = SweepExecutor(jobs, path_to_sim, SWEEP_DIR_FORMAT.format(path_to_sim, run_name), workers, 0)
+        status = executor.run()
+        for name, cfg in jobs:
+            if status[name]["state"] == "done":
+                metrics = sim_run_metrics(name, time_dropped=time_dropped, results_dir=RESULTS_DIR.format(path_to_sim))
+                completed.append([float(x) for x in metrics])
+
+        # Estimate the replicas needed for the target width, since the width shrinks with the square root of the count
+        if len(completed) < 2:
+            print("Fewer than two replicas completed")
+            exit(1)
+        width = relative_width(confidence_interval([x[METRIC_NAMES.index(TARGET_METRIC)] for x in completed],
+                                                   confidence))
+        print("{} replicas, {} CI relative width {}".format(len(completed), TARGET_METRIC, width))
+        if width is None or width <= target_width:
+            break
+        needed = math.ceil(len(completed) * (width / target_width) ** 2)
+        batch_size = max(0, min(max(needed, replica_count + 1), max_replicas) - replica_count)
+
+    output_file = open(sys.argv[2], "w")
+    output_file.write(REPLICATE_CSV_HEADER + "\n")
+    for i, metric in enumerate(METRIC_NAMES):
+        interval = confidence_interval([x[i] for x in completed], confidence)
+        width = relative_width(interval)
+        output_file.write("{},{},{},{},{},{}\n".format(metric, *interval, width if width is not None else "",
+                                                       len(completed)))
+    output_file.close()
+    print("Results for {} replicas written to {}".format(len(completed), sys.argv[2]))
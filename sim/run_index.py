@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""SQLite index of saved simulation runs, with a command line query tool."""
+
+import json
+import os
+import sqlite3
+import struct
+import sys
+
+from latency_histogram import LatencyHistogram, HISTOGRAM_FILE, load_histograms
+from record_file import read_header, RECORD_FILE_EXTENSION
+
+INDEX_FILE = "run_index.db"
+
+# Seconds to wait for another process (ex. a parallel simulation) to finish writing to the index
+LOCK_TIMEOUT = 60
+
+LATENCY_PERCENTILES = [50, 95, 99, 99.9]
+
+
+def open_index(results_dir):
+    """Open (and create if needed) the index of a results directory."""
+    connection = sqlite3.connect(os.path.join(results_dir, INDEX_FILE), timeout=LOCK_TIMEOUT)
+    # Configuration parameters and stats are added as columns as they are first seen
+    connection.execute("CREATE TABLE IF NOT EXISTS runs (name TEXT PRIMARY KEY, description TEXT, results_dir TEXT, "
+                       "files TEXT)")
+    return connection
+
+
+def quote(column):
+    """Return a column name quoted for SQL (stat names contain spaces and symbols)."""
+    return '"{}"'.format(column.replace('"', '""'))
+
+
+def run_record(config, stats, latency_histogram, run_dir):
+    """Return the values to index for a run: its scalar configuration parameters, stats and latency percentiles."""
+    record = {"name": config["name"], "description": config["description"],
+              "results_dir": os.path.abspath(run_dir), "files": ",".join(sorted(os.listdir(run_dir)))}
+    for key, value in list(config.items()) + list(stats.items()):
+        if key not in record and (value is None or isinstance(value, (bool, int, float, str))):
+            record[key] = value
+    if latency_histogram is not None and latency_histogram.count > 0:
+        record["Mean Latency"] = latency_histogram.mean()
+        for percentile in LATENCY_PERCENTILES:
+            record["{}% Latency".format(percentile)] = latency_histogram.percentile(percentile)
+    return record
+
+
+def add_run(results_dir, record):
+    """Add or replace the record of a run in the index."""
+    connection = open_index(results_dir)
+    with connection:
+        # Take the write lock first so that concurrent writers do not add the same column
+        connection.execute("BEGIN IMMEDIATE")
+        # Column names are not case sensitive in SQLite
+        existing = [row[1].lower() for row in connection.execute("PRAGMA table_info(runs)")]
+        for column in record:
+            if column.lower() not in existing:
+                connection.execute("ALTER TABLE runs ADD COLUMN {}".format(quote(column)))
+        columns = list(record)
+        connection.execute("INSERT OR REPLACE INTO runs ({}) VALUES ({})".format(
+            ",".join([quote(x) for x in columns]), ",".join(["?"] * len(columns))), [record[x] for x in columns])
+    connection.close()
+
+
+def remove_runs(results_dir, name_part):
+    """Remove all runs whose names contain the given text from the index and return how many were removed."""
+    if not os.path.isfile(os.path.join(results_dir, INDEX_FILE)):
+        return 0
+    connection = open_index(results_dir)
+    with connection:
+        removed = connection.execute("DELETE FROM runs WHERE instr(name, ?) > 0", [name_part]).rowcount
+    connection.close()
+    return removed
+
+
+def task_latency_histogram(run_dir, warmup_time):
+    """Return a histogram of the latencies of completed tasks that arrived after the warm-up, read from the task file."""
+    histogram = LatencyHistogram()
+    if os.path.isfile(run_dir + "task_times" + RECORD_FILE_EXTENSION):
+        with open(run_dir + "task_times" + RECORD_FILE_EXTENSION, "rb") as task_file:
+            header, offset = read_header(task_file)
+            record = struct.Struct("<" + "".join(header["types"]))
+            while True:
+                chunk = task_file.read(record.size * 4096)
+                if len(chunk) == 0:
+                    break
+                for values in record.iter_unpack(chunk):
+                    if values[0] > warmup_time and values[1] >= 0:
+                        histogram.record(values[1])
+    elif os.path.isfile(run_dir + "task_times.csv"):
+        with open(run_dir + "task_times.csv", "r") as task_file:
+            next(task_file)
+            for line in task_file:
+                values = line.split(",", 2)
+                if int(values[0]) > warmup_time and int(values[1]) >= 0:
+                    histogram.record(int(values[1]))
+    return histogram
+
+
+def run_latency_histogram(run_dir, config):
+    """Return the overall latency histogram of a saved run, computed from its task times if it has no saved histograms."""
+    if os.path.isfile(run_dir + HISTOGRAM_FILE):
+        return load_histograms(run_dir + HISTOGRAM_FILE)[0]
+    warmup = config.get("histogram_warmup", 0) * config["sim_duration"] if config["sim_duration"] else 0
+    return task_latency_histogram(run_dir, warmup)
+
+
+def rebuild(results_dir):
+    """Index every saved run in a results directory (ex. runs saved before the index existed)."""
+    count = 0
+    for dir_name in sorted(os.listdir(results_dir)):
+        run_dir = os.path.join(results_dir, dir_name) + "/"
+        if not dir_name.startswith("sim_") or not os.path.isfile(run_dir + "stats.json"):
+            continue
+        meta_file = open(run_dir + "meta.json", "r")
+        config = json.load(meta_file)
+        meta_file.close()
+        stats_file = open(run_dir + "stats.json", "r")
+        stats = json.load(stats_file)
+        stats_file.close()
+        add_run(results_dir, run_record(config, stats, run_latency_histogram(run_dir, config), run_dir))
+        count += 1
+    return count
+
+
+def query(results_dir, conditions, sort=None, columns=None, limit=None):
+    """Return the column names and rows of the runs matching all conditions.
+    :param conditions: Dictionary of column names to required values
+    :param sort: Column to sort by (prefix with - for descending order)
+    :param columns: Columns to return (default: the name, description, conditions and sort column)
+    :param limit: Maximum number of rows
+    """
+    if columns is None:
+        columns = ["name", "description"] + [x for x in conditions if x not in ["name", "description"]]
+        if sort is not None and sort.lstrip("-") not in columns:
+            columns.append(sort.lstrip("-"))
+
+    connection = open_index(results_dir)
+    existing = [row[1].lower() for row in connection.execute("PRAGMA table_info(runs)")]
+    for column in columns + list(conditions) + ([sort.lstrip("-")] if sort is not None else []):
+        if column.lower() not in existing:
+            connection.close()
+            raise sqlite3.OperationalError("no such column: {}".format(column))
+    statement = "SELECT {} FROM runs".format(",".join([quote(x) for x in columns]))
+    if len(conditions) > 0:
+        statement += " WHERE " + " AND ".join(["{} IS ?".format(quote(x)) for x in conditions])
+    if sort is not None:
+        statement += " ORDER BY {}{}".format(quote(sort.lstrip("-")), " DESC" if sort.startswith("-") else "")
+    if limit is not None:
+        statement += " LIMIT {}".format(int(limit))
+    cursor = connection.execute(statement, list(conditions.values()))
+    result = [x[0] for x in cursor.description], cursor.fetchall()
+    connection.close()
+    return result
+
+
+def parse_value(text):
+    """Interpret a value given on the command line as JSON if possible (ex. true, 32, null), otherwise as text."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+if __name__ == "__main__":
+    # Arguments: <parameter>=<value> conditions, -sort <column>, -columns <column,column,...>, -limit <n>, -rebuild
+    results_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "results")
+    if not os.path.isdir(results_path):
+        print("No results directory found")
+        exit(1)
+
+    if "-rebuild" in sys.argv:
+        print("Indexed {} runs".format(rebuild(results_path)))
+        exit(0)
+
+    options = {"-sort": None, "-columns": None, "-limit": None}
+    filters = {}
+    args = sys.argv[1:]
+    while len(args) > 0:
+        arg = args.pop(0)
+        if arg in options and len(args) > 0:
+            options[arg] = args.pop(0)
+        elif "=" in arg:
+            key, value = arg.split("=", 1)
+            filters[key] = parse_value(value)
+        else:
+            print("Usage: python3 run_index.py [<parameter>=<value> ...] [-sort <column>] "
+                  "[-columns <column,column,...>] [-limit <n>] [-rebuild]")
+            exit(1)
+
+    try:
+        header, rows = query(results_path, filters, sort=options["-sort"], limit=options["-limit"],
+                             columns=options["-columns"].split(",") if options["-columns"] else None)
+    except sqlite3.OperationalError as e:
+        print("Invalid query: {}".format(e))
+        exit(1)
+    print(",".join(header))
+    for row in rows:
+        print(",".join(["" if x is None else str(x) for x in row]))
@@ -4,11 +4,18 @@ from sim_config import SimConfig
 
 import sys
 import os
+import time as timer
+import shutil
+from collections import deque
 from datetime import datetime
 import multiprocessing
+import multiprocessing.connection
 import json
 import pathlib
 
+SWEEP_DIR_FORMAT = "{}/results/sweep_{}/"
+SWEEP_STATUS_FILE = "status.json"
+
 
 class SimProcess(multiprocessing.Process):
     def __init__(self, thread_id, name, configuration, sim_dir_path):
@@ -26,17 +33,216 @@ class SimProcess(multiprocessing.Process):
         print("Exiting " + self.name)
 
 
+class SweepExecutor:
+    """Runs simulation jobs on a bounded number of worker processes.
+    The status of each job is recorded on disk so that failed jobs can be retried and a relaunched sweep skips jobs
+    that already completed.
+    """
+
+    def __init__(self, jobs, sim_dir_path, sweep_dir, workers, retries):
+        """
+        :param jobs: List of (name, configuration) pairs
+        :param sim_dir_path: Path to the simulator directory
+        :param sweep_dir: Directory to keep the sweep status in
+        :param workers: Maximum number of simulations to run at once
+        :param retries: Number of times to rerun a failed job
+        """
+        if workers < 1 or retries < 0:
+            raise ValueError("A sweep needs at least one worker and a non-negative number of retries")
+        self.jobs = jobs
+        self.sim_path = sim_dir_path
+        self.sweep_dir = sweep_dir
+        self.workers = workers
+        self.retries = retries
+        self.status = load_status(sweep_dir)
+        self.check_jobs()
+
+    def check_jobs(self):
+        """Make sure that a relaunched sweep has the same jobs, with the same configurations, as the recorded ones."""
+        if len(self.status) == 0:
+            return
+        names = [name for name, config in self.jobs]
+        if sorted(names) != sorted(self.status):
+            raise ValueError("The jobs of the sweep do not match its recorded jobs")
+        changed = [name for name, config in self.jobs
+                   if "config" in self.status[name] and self.status[name]["config"] != job_config(config)]
+        if len(changed) > 0:
+            raise ValueError("The configurations of {} do not match the recorded ones".format(", ".join(changed)))
+
+    def results_dir(self, name):
+        """Return the results directory of a job."""
+        return RESULTS_DIR.format(self.sim_path) + "sim_{}/".format(name)
+
+    def is_complete(self, name):
+        """Return true if the job finished in an earlier launch of the sweep and its results are still there."""
+        return name in self.status and self.status[name]["state"] == "done" and \
+            os.path.isfile(self.results_dir(name) + "stats.json")
+
+    def save_status(self):
+        """Write the status of all jobs, replacing the file at once so that it is never partially written."""
+        if not os.path.isdir(self.sweep_dir):
+            os.makedirs(self.sweep_dir)
+        counts = {}
+        for job_status in self.status.values():
+            counts[job_status["state"]] = counts.get(job_status["state"], 0) + 1
+        status_file = open(self.sweep_dir + SWEEP_STATUS_FILE + ".tmp", "w")
+        json.dump({"counts": counts, "jobs": self.status}, status_file, indent=0)
+        status_file.close()
+        os.replace(self.sweep_dir + SWEEP_STATUS_FILE + ".tmp", self.sweep_dir + SWEEP_STATUS_FILE)
+
+    def start(self, thread_id, name, config):
+        """Start a job in a new process, clearing any partial results of an earlier attempt."""
+        if os.path.isdir(self.results_dir(name)):
+            shutil.rmtree(self.results_dir(name))
+        process = SimProcess(thread_id, name, config, self.sim_path)
+        process.start()
+
+        job_status = self.status[name]
+        job_status["state"] = "running"
+        job_status["attempts"] += 1
+        job_status["start"] = timer.time()
+        return process
+
+    def run(self):
+        """Run all incomplete jobs and return the status of every job."""
+        pending = deque()
+        for i, (name, config) in enumerate(self.jobs):
+            if self.is_complete(name):
+                print("Skipping " + name + " (already complete)")
+            else:
+                self.status[name] = {"state": "pending", "attempts": 0, "config": job_config(config)}
+                pending.append((i, name, config))
+        self.save_status()
+
+        running = {}
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < self.workers:
+                job = pending.popleft()
+                running[job[1]] = (self.start(*job), job)
+            self.save_status()
+
+            # Wait for any running job to exit
+            multiprocessing.connection.wait([process.sentinel for process, job in running.values()])
+            for name, (process, job) in list(running.items()):
+                if process.exitcode is None:
+                    continue
+                process.join()
+                del running[name]
+
+                job_status = self.status[name]
+                job_status["exit_code"] = process.exitcode
+                job_status["elapsed"] = timer.time() - job_status.pop("start")
+                if process.exitcode == 0:
+                    job_status["state"] = "done"
+                elif job_status["attempts"] <= self.retries:
+                    print("Retrying {} (exit code {})".format(name, process.exitcode))
+                    job_status["state"] = "pending"
+                    pending.append(job)
+                else:
+                    print("Failed {} (exit code {})".format(name, process.exitcode))
+                    job_status["state"] = "failed"
+            self.save_status()
+
+        return self.status
+
+    def summary(self):
+        """Return a readable summary of the sweep."""
+        lines = ["Sweep summary ({} jobs):".format(len(self.jobs))]
+        for name, config in self.jobs:
+            job_status = self.status.get(name, {"state": "unknown", "attempts": 0})
+            elapsed = " in {:.1f}s".format(job_status["elapsed"]) if "elapsed" in job_status else ""
+            lines.append("  {}: {} after {} attempt(s){}".format(name, job_status["state"], job_status["attempts"],
+                                                                 elapsed))
+        incomplete = [name for name, config in self.jobs if self.status.get(name, {}).get("state") != "done"]
+        lines.append("All jobs completed" if len(incomplete) == 0 else
+                     "{} job(s) did not complete".format(len(incomplete)))
+        return "\n".join(lines)
+
+
+def load_status(sweep_dir):
+    """Return the recorded status of each job of a sweep (empty if the sweep has not been launched)."""
+    if not os.path.isfile(sweep_dir + SWEEP_STATUS_FILE):
+        return {}
+    status_file = open(sweep_dir + SWEEP_STATUS_FILE, "r")
+    status = json.load(status_file)["jobs"]
+    status_file.close()
+    return status
+
+
+def job_config(config):
+    """Return a job's configuration as it is recorded in the sweep status."""
+    return json.loads(json.dumps(config.__dict__))
+
+
+def restore_recorded_job(config, recorded):
+    """Give a job of a resumed sweep the queue permutation (drawn at random) and description it was launched with."""
+    if recorded is not None and "config" in recorded:
+        config.WS_PERMUTATION = recorded["config"]["WS_PERMUTATION"]
+        config.description = recorded["config"]["description"]
+
+
+def pop_option(option, default=None):
+    """Remove an option and its value from the arguments and return the value (or the default if not given)."""
+    if option not in sys.argv:
+        return default
+    index = sys.argv.index(option)
+    value = sys.argv[index + 1]
+    del sys.argv[index:index + 2]
+    return value
+
+
+def available_memory_mb():
+    """Return the memory currently available for new processes in MB, or None if it is unknown."""
+    if not os.path.isfile("/proc/meminfo"):
+        return None
+    meminfo = open("/proc/meminfo", "r")
+    lines = meminfo.readlines()
+    meminfo.close()
+    for line in lines:
+        if line.startswith("MemAvailable:"):
+            return int(line.split()[1]) // 1024
+    return None
+
+
 if __name__ == "__main__":
     time = datetime.now().strftime("%y-%m-%d_%H:%M:%S")
 
     loads = list(range(10, 110, 10))
-    threads = []
+    jobs = []
     cores = None
     description = ""
 
     path_to_sim = os.path.relpath(pathlib.Path(__file__).resolve().parents[1], start=os.curdir)
 
-    if os.path.isfile(sys.argv[1]):
+    # Sweep options
+    workers = int(pop_option("-workers", os.cpu_count()))
+    retries = int(pop_option("-retries", 2))
+    job_memory = pop_option("-jobmem")
+    if workers < 1 or retries < 0 or (job_memory is not None and int(job_memory) <= 0):
+        print("Workers and job memory must be positive and retries must not be negative.")
+        exit(1)
+    resume_name = pop_option("-resume")
+    if resume_name is not None:
+        time = resume_name[len(os.uname().nodename) + 1:]
+    sweep_name = SINGLE_THREAD_SIM_NAME_FORMAT.format(os.uname().nodename, time)
+
+    # Limit the number of workers so that all jobs fit in the available memory
+    if job_memory is not None and available_memory_mb() is not None:
+        workers = max(1, min(workers, available_memory_mb() // int(job_memory)))
+
+    # A resumed sweep uses the configuration recorded when it was launched and the recorded job configurations (ex.
+    # queue permutations), not the configuration file as it is now
+    cfg_json = None
+    recorded_jobs = {}
+    if resume_name is not None:
+        if not os.path.isfile(CONFIG_LOG_DIR.format(path_to_sim) + sweep_name + ".json"):
+            print("No configuration recorded for sweep {}".format(sweep_name))
+            exit(1)
+        cfg_json_fp = open(CONFIG_LOG_DIR.format(path_to_sim) + sweep_name + ".json", "r")
+        cfg_json = cfg_json_fp.read()
+        cfg_json_fp.close()
+        recorded_jobs = load_status(SWEEP_DIR_FORMAT.format(path_to_sim, sweep_name))
+    elif os.path.isfile(sys.argv[1]):
         cfg_json_fp = open(sys.argv[1], "r")
         cfg_json = cfg_json_fp.read()
         cfg_json_fp.close()
@@ -47,11 +253,12 @@ if __name__ == "__main__":
 
     if len(sys.argv) > 2:
         name = SINGLE_THREAD_SIM_NAME_FORMAT.format(os.uname().nodename, time)
-        if not os.path.isdir(RESULTS_DIR.format(path_to_sim)):
-            os.makedirs(RESULTS_DIR.format(path_to_sim))
-        meta_log = open(META_LOG_FILE.format(path_to_sim), "a")
-        meta_log.write("{}: {}\n".format(name, sys.argv[2]))
-        meta_log.close()
+        if resume_name is None:
+            if not os.path.isdir(RESULTS_DIR.format(path_to_sim)):
+                os.makedirs(RESULTS_DIR.format(path_to_sim))
+            meta_log = open(META_LOG_FILE.format(path_to_sim), "a")
+            meta_log.write("{}: {}\n".format(name, sys.argv[2]))
+            meta_log.close()
         description = sys.argv[2]
 
 
@@ -59,7 +266,7 @@ if __name__ == "__main__":
         for i, core_num in enumerate(cores):
             name = MULTI_THREAD_SIM_NAME_FORMAT.format(os.uname().nodename, time, i)
 
-            if os.path.isfile(sys.argv[1]):
+            if cfg_json is not None:
                 cfg = json.loads(cfg_json, object_hook=SimConfig.decode_object)
                 if cfg.reallocation_replay:
                     name_parts = cfg.reallocation_record.split("_", 1)
@@ -72,18 +279,19 @@ if __name__ == "__main__":
                 cfg.name = name
                 cfg.description = description
                 cfg.progress_bar = (i == 0)
+                restore_recorded_job(cfg, recorded_jobs.get(name))
 
             else:
                 print("Missing or invalid argument")
                 exit(1)
 
-            threads.append(SimProcess(i, name, cfg, path_to_sim))
+            jobs.append((name, cfg))
 
     else:
         for i, load in enumerate(loads):
             name = MULTI_THREAD_SIM_NAME_FORMAT.format(os.uname().nodename, time, i)
 
-            if os.path.isfile(sys.argv[1]):
+            if cfg_json is not None:
                 cfg = json.loads(cfg_json, object_hook=SimConfig.decode_object)
                 if cfg.reallocation_replay:
                     name_parts = cfg.reallocation_record.split("_", 1)
@@ -92,21 +300,27 @@ if __name__ == "__main__":
                 cfg.name = name
                 cfg.progress_bar = (i == 0)
                 cfg.description = description
+                restore_recorded_job(cfg, recorded_jobs.get(name))
 
             else:
                 print("Missing or invalid argument")
                 exit(1)
 
-            threads.append(SimProcess(i, name, cfg, path_to_sim))
+            jobs.append((name, cfg))
 
-    threads.reverse()
-    for thread in threads:
-        thread.start()
+    if resume_name is None:
+        if not(os.path.isdir(CONFIG_LOG_DIR.format(path_to_sim))):
+            os.makedirs(CONFIG_LOG_DIR.format(path_to_sim))
+        config_record = open(CONFIG_LOG_DIR.format(path_to_sim) + sweep_name + ".json", "w")
+        config_record.write(cfg_json)
+        config_record.close()
 
-    if not(os.path.isdir(CONFIG_LOG_DIR.format(path_to_sim))):
-        os.makedirs(CONFIG_LOG_DIR.format(path_to_sim))
-    config_record = open(
-        CONFIG_LOG_DIR.format(path_to_sim) + SINGLE_THREAD_SIM_NAME_FORMAT.format(os.uname().nodename, time) + ".json",
-        "w")
-    config_record.write(cfg_json)
-    config_record.close()
+    # Highest loads/core counts are started first
+    jobs.reverse()
+    try:
+        executor = SweepExecutor(jobs, path_to_sim, SWEEP_DIR_FORMAT.format(path_to_sim, sweep_name), workers, retries)
+    except ValueError as e:
+        print("Cannot resume sweep {}: {}".format(sweep_name, e))
+        exit(1)
+    executor.run()
+    print(executor.summary())
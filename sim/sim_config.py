@@ -3,6 +3,8 @@
 
 import random
 
+from distributions import make_distribution
+
 
 class SimConfig:
     """Object to hold all configuration state of the simulation. Remains constant."""
@@ -16,7 +18,11 @@ class SimConfig:
                  enqueue_by_st_sum=False, always_check_realloc=False, ideal_flag_steal=False, delay_range_by_service_time=False,
                  ideal_reallocation=False, fred_reallocation=False, spin_parking_enabled=False, utilization_range_enabled=False,
                  allow_naive_idle=False, work_steal_park_enabled=False, bimodal_service_time=False, join_bounded_shortest_queue=False,
-                 record_queue_lens=False):
+                 record_queue_lens=False, event_queue=False, verify_queue_totals=False, trace=False,
+                 checkpoint_interval=None, latency_histograms=False, histogram_window=None, histogram_warmup=0,
+                 binary_results=False, workload_trace=None, workload_trace_start=None, workload_trace_end=None,
+                 vectorized_workload=False, service_time_distribution=None,
+                 profile=False):
         # Basic configuration
         self.name = name
         self.description = ""
@@ -33,6 +39,7 @@ class SimConfig:
         self.work_stealing_enabled = ws_enabled
         self.parking_enabled = parking
         self.fast_forward_enabled = ff_enabled
+        self.event_queue_enabled = event_queue
         self.progress_bar = pb_enabled
         self.record_allocations = record_allocations
         self.reallocation_record = realloc_record
@@ -63,6 +70,19 @@ class SimConfig:
         self.bimodal_service_time = bimodal_service_time
         self.join_bounded_shortest_queue = join_bounded_shortest_queue
         self.record_queue_lens = record_queue_lens
+        self.verify_queue_totals = verify_queue_totals
+        self.trace_enabled = trace
+        self.checkpoint_interval = checkpoint_interval
+        self.latency_histograms_enabled = latency_histograms
+        self.histogram_window = histogram_window
+        self.histogram_warmup = histogram_warmup
+        self.binary_results = binary_results
+        self.workload_trace = workload_trace
+        self.workload_trace_start = workload_trace_start
+        self.workload_trace_end = workload_trace_end
+        self.vectorized_workload = vectorized_workload
+        self.service_time_distribution = service_time_distribution
+        self.profile_enabled = profile
 
         # Constants
         self.AVERAGE_SERVICE_TIME = 1000
@@ -137,10 +157,6 @@ class SimConfig:
             print("Only one allocation policy may be enabled.")
             return False
 
-        if self.reallocation_replay and self.num_queues != 1:
-            print("Reallocation replay assumes one queue.")
-            return False
-
         if self.work_stealing_enabled and self.num_queues == 1:
             print("Cannot work steal with one queue.")
             return False
@@ -170,10 +186,45 @@ class SimConfig:
             print("To utilize extra choices, random work steal search must be enabled.")
             return False
 
-        if self.bimodal_service_time and self.constant_service_time:
+        if sum([self.bimodal_service_time, self.constant_service_time,
+                self.service_time_distribution is not None]) > 1:
             print("Only one service time distribution can be specified.")
             return False
 
+        if self.service_time_distribution is not None:
+            try:
+                make_distribution(self.service_time_distribution)
+            except (TypeError, ValueError) as e:
+                print("Invalid service time distribution: {}".format(e))
+                return False
+
+        if self.event_queue_enabled and not self.fast_forward_enabled:
+            print("The event queue can only be used when fast forwarding.")
+            return False
+
+        if self.checkpoint_interval is not None and self.checkpoint_interval <= 0:
+            print("The checkpoint interval must be positive.")
+            return False
+
+        if self.histogram_window is not None and self.histogram_window <= 0:
+            print("The histogram window must be positive.")
+            return False
+
+        if not 0 <= self.histogram_warmup < 1:
+            print("The histogram warm-up must be a fraction of the simulation duration.")
+            return False
+
+        if self.workload_trace is not None and \
+                (self.constant_service_time or self.bimodal_service_time or self.regular_arrivals or
+                 self.service_time_distribution is not None):
+            print("Workload traces provide their own arrival and service times.")
+            return False
+
+        if self.workload_trace_start is not None and self.workload_trace_end is not None and \
+                self.workload_trace_end <= self.workload_trace_start:
+            print("The workload trace window must end after it starts.")
+            return False
+
         # At least one way to decide when the simulation is over is needed
         if (self.num_tasks is None and self.sim_duration is None) or \
                 (self.num_tasks is not None and self.num_tasks <= 0) or \
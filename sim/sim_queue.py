@@ -1,19 +1,29 @@
 #!/usr/bin/env python
 """Queue object for incoming tasks."""
 
+import heapq
+import operator
+from collections import deque
+
 from work_search_state import WorkSearchState
 
+ARRIVAL_TIME = operator.attrgetter("arrival_time")
+
 
 class Queue:
     """Queue with locking capabilities."""
 
+    __slots__ = ("queue", "locked", "lock_owners", "id", "thread_ids", "locking_enabled", "last_ws_check",
+                 "awaiting_enqueue", "service_time_sum", "head_arrival", "check_count", "sweep_base",
+                 "config", "state")
+
     # Initial lock for beginning of simulation
     # Only threads mapped to the queue can take the lock from the default
     DEFAULT_LOCK_ID = -1
     MAIN_QUEUE_ID = -1
 
     def __init__(self, identifier, config, state):
-        self.queue = []
+        self.queue = deque()
         self.locked = True
         self.lock_owners = [Queue.DEFAULT_LOCK_ID]
         self.id = identifier
@@ -21,6 +31,10 @@ class Queue:
         self.locking_enabled = config.locking_enabled
         self.last_ws_check = 0
         self.awaiting_enqueue = False
+        self.service_time_sum = 0
+        self.head_arrival = None
+        self.check_count = 0
+        self.sweep_base = 0
         self.config = config
         self.state = state
 
@@ -74,6 +88,7 @@ class Queue:
             if get_lock:
                 self.lock_owners.append(thread_id)
                 self.locked = True
+                self.update_stealable()
             return True
         # Thread already has the lock
         elif self.locked and thread_id in self.lock_owners:
@@ -100,6 +115,7 @@ class Queue:
             self.lock_owners.remove(thread_id)
             if len(self.lock_owners) == 0:
                 self.locked = False
+                self.update_stealable()
 
     def enqueue(self, task, set_original=False, requeued=False, stolen=False, flag_steal=False,
                 flag_time=None, threshold_time=None):
@@ -124,25 +140,125 @@ class Queue:
         if requeued:
             task.requeue_time = self.state.timer.get_time()
 
+        task.check_epoch = self.checks()
         if stolen:
-            self.queue.insert(0, task)
-            task.steal_count += 1
-            if flag_steal:
-                task.flag_steal_count += 1
-                task.flag_wait_time += (self.state.timer.get_time() - flag_time)
-                task.flag_set_delay += (flag_time - threshold_time)
-            task.requeue_time = self.state.timer.get_time()
+            self.mark_stolen(task, flag_time if flag_steal else None, threshold_time)
+            self.queue.appendleft(task)
+            self.update_head()
         else:
             self.queue.append(task)
+            if len(self.queue) == 1:
+                self.update_head()
+            elif len(self.queue) == 2:
+                self.update_second()
+        self.update_totals(1, task.service_time)
+
+    def mark_stolen(self, task, flag_time=None, threshold_time=None):
+        """Update the steal accounting of a task moved to the front of this queue.
+        :param task: Stolen task
+        :param flag_time: Time that the flag requesting a steal was raised (None if not a flag steal)
+        :param threshold_time: Time that the flag steal threshold was crossed by the original queue
+        """
+        task.steal_count += 1
+        if flag_time is not None:
+            task.flag_steal_count += 1
+            task.flag_wait_time += (self.state.timer.get_time() - flag_time)
+            task.flag_set_delay += (flag_time - threshold_time)
+        task.requeue_time = self.state.timer.get_time()
+
+    def steal_from(self, remote, count, flag_time=None, threshold_time=None, merge_by_arrival=False):
+        """Move tasks from the head of a remote queue to the front of this queue, keeping their order.
+        :param remote: Queue to steal from
+        :param count: Number of tasks to move
+        :param flag_time: Time that the flag requesting a steal was raised (None if not a flag steal)
+        :param threshold_time: Time that the flag steal threshold was crossed by the original queue
+        :param merge_by_arrival: If true, order this queue by arrival time after the steal (stolen tasks go first
+        among tasks with equal arrival times)
+        """
+        # Dequeueing may refill a bounded queue from the main queue, so take tasks one at a time
+        if self.config.join_bounded_shortest_queue:
+            stolen = [remote.dequeue() for i in range(count)]
+            stolen_service_time = sum([task.service_time for task in stolen])
+        else:
+            stolen = [remote.queue.popleft() for i in range(count)]
+            stolen_service_time = sum([task.service_time for task in stolen])
+            for task in stolen:
+                remote.record_checks(task)
+            remote.update_head()
+            remote.update_totals(-len(stolen), -stolen_service_time)
+
+        front_task_time = self.state.threads[self.get_core()].current_task.time_left \
+            if self.state.threads[self.get_core()].current_task is not None else 0
+        for task in stolen:
+            task.front_task_time = front_task_time
+            task.check_epoch = self.checks()
+            self.mark_stolen(task, flag_time, threshold_time)
+
+        if merge_by_arrival:
+            self.merge_by_arrival(stolen)
+        else:
+            self.queue.extendleft(reversed(stolen))
+        self.update_head()
+        self.update_totals(len(stolen), stolen_service_time)
+
+    def merge_by_arrival(self, tasks):
+        """Add tasks to the front of the queue, keeping it in arrival order (queues are kept in arrival order with ideal
+        flag steals). Only the queued tasks that arrived before the last of the tasks are merged with them.
+        :param tasks: Tasks to add, in arrival order (placed before queued tasks with the same arrival time)
+        """
+        if len(tasks) == 0:
+            return
+        overlap = []
+        while len(self.queue) > 0 and self.queue[0].arrival_time < tasks[-1].arrival_time:
+            overlap.append(self.queue.popleft())
+        self.queue.extendleft(reversed(list(heapq.merge(tasks, overlap, key=ARRIVAL_TIME))))
 
     def dequeue(self):
         """Remove and return turn task from the front of the queue."""
         if self.id != -1 and self.config.join_bounded_shortest_queue and len(self.queue) <= self.config.QUEUE_BOUND:
             while len(self.queue) <= self.config.QUEUE_BOUND and self.state.main_queue.length() >= 1:
                 self.enqueue(self.state.main_queue.dequeue(), set_original=True)
-            task = self.queue.pop(0)
-            return task
-        return self.queue.pop(0)
+        task = self.queue.popleft()
+        self.record_checks(task)
+        self.update_head()
+        self.update_totals(-1, -task.service_time)
+        return task
+
+    def update_head(self):
+        """Update the head-of-line accounting of the simulation state after the head of the queue changes."""
+        if self.id == self.MAIN_QUEUE_ID:
+            return
+        head_arrival = self.queue[0].arrival_time if len(self.queue) > 0 else None
+        self.state.update_queue_head(self.id, self.head_arrival, head_arrival)
+        if (head_arrival is None) != (self.head_arrival is None):
+            # Checks from check sweeps only apply while the queue has tasks
+            if head_arrival is None:
+                self.check_count += self.state.queue_sweep_count - self.sweep_base
+            else:
+                self.sweep_base = self.state.queue_sweep_count
+            self.update_stealable()
+        self.head_arrival = head_arrival
+        self.update_second()
+
+    def update_second(self):
+        """Update the ideal flag stealing order of the queue's threads after the second task of the queue changes."""
+        if self.state.flag_helpers is not None and self.state.flag_helpers.ideal:
+            for thread_id in self.thread_ids:
+                self.state.flag_helpers.update(self.state.threads[thread_id])
+
+    def update_stealable(self):
+        """Update the work-available index of the simulation state after the queue empties, fills, locks or unlocks."""
+        if self.locking_enabled and self.id != self.MAIN_QUEUE_ID:
+            self.state.update_stealable_queue(self.id, len(self.queue) > 0 and not self.locked)
+
+    def update_totals(self, count, service_time):
+        """Update the running totals of the queue and of the simulation state after tasks are added or removed.
+        :param count: Change in the number of queued tasks
+        :param service_time: Change in the sum of queued service times
+        """
+        self.service_time_sum += service_time
+        if self.id != self.MAIN_QUEUE_ID:
+            self.state.update_queue_totals(count, service_time)
 
     def length(self, count_current=False):
         """Return the length of the queue."""
@@ -152,10 +268,10 @@ class Queue:
 
     def length_by_service_time(self):
         """Return the length of the queue as the sum of the service times present."""
-        sum = 0
-        for item in self.queue:
-            sum += item.service_time
-        return sum
+        if self.config.verify_queue_totals:
+            self.state.check_total("Queue {} service time".format(self.id), self.service_time_sum,
+                                   sum([item.service_time for item in self.queue]))
+        return self.service_time_sum
 
     def get_threads_by_status(self, is_parked):
         """Return a list of threads mapped to the queue that match the given parking status.
@@ -169,9 +285,25 @@ class Queue:
         return matching
 
     def update_check_counts(self):
-        """Update the queue check counter for each task in the queue to track work steal checks."""
+        """Count a work steal check of the queue. Tasks in the queue pick up the checks when they leave it."""
+        self.check_count += 1
+
+    def checks(self):
+        """Return the number of work steal checks made on the queue, including check sweeps while it had tasks."""
+        if self.head_arrival is not None:
+            return self.check_count + self.state.queue_sweep_count - self.sweep_base
+        return self.check_count
+
+    def record_checks(self, task):
+        """Add the work steal checks of the queue since the task entered it (or was last updated) to its count."""
+        checks = self.checks()
+        task.queue_checks += checks - task.check_epoch
+        task.check_epoch = checks
+
+    def record_all_checks(self):
+        """Bring the queue check counts of all tasks still in the queue up to date."""
         for task in self.queue:
-            task.queue_checks += 1
+            self.record_checks(task)
 
     def current_delay(self, second=False):
         """Return the current queueing delay (defined as time since the reference item in the queue arrived).
@@ -184,7 +316,8 @@ class Queue:
 
     def sort_by_arrival(self):
         """Sort the queue by the arrival time of tasks."""
-        self.queue.sort(key=lambda x: x.arrival_time)
+        self.queue = deque(sorted(self.queue, key=ARRIVAL_TIME))
+        self.update_head()
 
     def second(self):
         """Return the second item in the queue if it exists."""
@@ -202,6 +335,9 @@ class Queue:
         for task in self.queue:
             if task.to_enqueue is not None and task.to_enqueue != self.id:
                 self.queue.remove(task)
+                self.record_checks(task)
+                self.update_head()
+                self.update_totals(-1, -task.service_time)
                 return task
         return None
 
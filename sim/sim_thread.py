@@ -4,18 +4,32 @@
 import random
 import logging
 from work_search_state import WorkSearchState
+import event_trace
+from record_file import INT16, time_type
 from tasks import WorkSearchSpin, WorkStealTask, Task, EnqueuePenaltyTask, RequeueTask, ReallocationTask, FlagStealTask, QueueCheckTask, OracleWorkStealTask, IdleTask
 
+# Task types whose busy time counts toward the busy time of reallocation intervals
+INTERVAL_BUSY_TASK_TYPES = (Task, WorkStealTask, WorkSearchSpin)
+
 
 class Thread:
     """Thread assigned to application to complete tasks."""
 
+    __slots__ = ("queue", "sibling", "current_task", "id", "work_search_state", "scheduled_dealloc", "previous_task_type",
+                 "enqueue_penalty", "enqueue_time", "requeue_time", "fred_preempt", "preempted_task",
+                 "classified_time_step", "classification", "distracted", "preempted_classification",
+                 "last_interval_task_time", "last_interval_busy_time", "work_steal_flag", "flag_sent", "flag_time",
+                 "flag_wait_time", "flag_set_delay", "threshold_time", "flag_task_time", "time_busy",
+                 "work_stealing_time", "task_time", "work_steal_wait_time", "successful_ws_time", "unsuccessful_ws_time",
+                 "allocation_time", "unpaired_time", "paired_time", "distracted_time", "last_complete",
+                 "last_allocation", "non_work_conserving_time", "config", "state")
+
     def __init__(self, given_queue, identifier, config, state, given_sibling=None):
         self.queue = given_queue
         self.sibling = given_sibling
         self.current_task = None
         self.id = identifier
-        self.work_search_state = WorkSearchState(config, state)
+        self.work_search_state = WorkSearchState(config, state, identifier)
         self.scheduled_dealloc = False
         self.previous_task_type = None
 
@@ -78,6 +92,12 @@ class Thread:
         """Return true if the thread is working on a productive task."""
         return self.current_task is not None and self.current_task.is_productive
 
+    def next_completion_time(self):
+        """Return the expected completion time of the current task or None if there is no (non-idle) task."""
+        if self.current_task is None or self.current_task.is_idle:
+            return None
+        return self.current_task.expected_completion_time()
+
     def is_distracted(self, evaluate=True):
         """Return true if the thread is working on overheads while there is a local task.
         Needs to be evaluated in each time step and not once it is over."""
@@ -101,8 +121,14 @@ class Thread:
         if self.queue.current_delay(second=True) > self.config.DELAY_THRESHOLD and not self.flag_sent and \
                 self.queue.length() > 1:
 
-            # Ideal flag stealing
-            if self.config.ideal_flag_steal:
+            # Ideal flag stealing (from the helper index if maintained)
+            if self.config.ideal_flag_steal and self.state.flag_helpers is not None:
+                helper = None
+                least_delayed = self.state.flag_helpers.least_delayed(self.state.timer.get_time())
+                if least_delayed is not None and least_delayed[0] < self.queue.current_delay(second=True):
+                    helper = least_delayed[1]
+
+            elif self.config.ideal_flag_steal:
                 helper = None
                 helper_delay = self.queue.current_delay(second=True)
                 for thread in self.state.threads:
@@ -113,8 +139,11 @@ class Thread:
 
             # Regular flag stealing
             else:
-                options = [x.id for x in self.state.threads if x.work_steal_flag is None and
-                           x.work_search_state.is_active() and x.id != self.id]
+                if self.state.flag_helpers is not None:
+                    options = self.state.flag_helpers.options(self.id)
+                else:
+                    options = [x.id for x in self.state.threads if x.work_steal_flag is None and
+                               x.work_search_state.is_active() and x.id != self.id]
 
                 if self.config.FLAG_OPTIONS > 1:
                     # Select flag_options-many options randomly
@@ -135,12 +164,18 @@ class Thread:
             if helper is not None:
                 self.state.flag_raise_count += 1
                 self.state.threads[helper].work_steal_flag = self.id
+                if self.state.flag_helpers is not None:
+                    self.state.flag_helpers.update(self.state.threads[helper])
                 self.flag_sent = True
                 self.flag_time = self.state.timer.get_time()
 
                 # Logging
-                logging.debug("Thread {} flagged thread {} (with a delay of {})"
-                              .format(self.id, helper, self.flag_time - self.threshold_time))
+                if self.state.trace is not None:
+                    self.state.trace.record(event_trace.FLAG_RAISE, self.id, helper,
+                                            self.flag_time - self.threshold_time)
+                if self.state.debug_logging:
+                    logging.debug("Thread {} flagged thread {} (with a delay of {})"
+                                  .format(self.id, helper, self.flag_time - self.threshold_time))
                 if self.state.threads[helper].current_task is not None:
                     self.state.threads[helper].current_task.flagged = True
                     self.state.threads[helper].current_task.flagged_time_left = \
@@ -148,7 +183,8 @@ class Thread:
                 else:
                     self.state.empty_flags += 1
 
-        if self.queue.current_delay(second=True) > self.config.DELAY_THRESHOLD and not self.flag_sent:
+        if self.state.debug_logging and self.queue.current_delay(second=True) > self.config.DELAY_THRESHOLD and \
+                not self.flag_sent:
             logging.debug("Thread {} failed to flag".format(self.id))
 
     def set_threshold_time(self):
@@ -162,8 +198,9 @@ class Thread:
         # Otherwise, this task was old before coming to this queue
         else:
             self.threshold_time = self.queue.second().requeue_time
-        logging.debug("Thread {}'s threshold time set to {} based on task {}".format(self.id, self.threshold_time,
-                                                                                     self.queue.second()))
+        if self.state.debug_logging:
+            logging.debug("Thread {}'s threshold time set to {} based on task {}".format(
+                self.id, self.threshold_time, self.queue.second()))
 
     def delay_flagging(self):
         """Set work steal flags as necessary."""
@@ -171,7 +208,8 @@ class Thread:
         # If the current delay is above the threshold and this is the first time, set the threshold time
         if self.queue.current_delay(second=True) > self.config.DELAY_THRESHOLD and self.threshold_time is None:
             self.set_threshold_time()
-            logging.debug("Thread {} crossed the threshold".format(self.id))
+            if self.state.debug_logging:
+                logging.debug("Thread {} crossed the threshold".format(self.id))
 
         # If the delay is below the threshold but the threshold time exists, empty it
         elif self.queue.current_delay(second=True) < self.config.DELAY_THRESHOLD and self.threshold_time is not None \
@@ -193,6 +231,9 @@ class Thread:
         if self.current_task.complete:
             if self.current_task.is_productive:
                 self.last_complete = self.state.timer.get_time()
+                if self.state.trace is not None:
+                    self.state.trace.record(event_trace.COMPLETION, self.id, self.current_task.original_queue,
+                                            self.current_task.time_in_system())
 
             self.previous_task_type = type(initial_task)
 
@@ -210,28 +251,45 @@ class Thread:
         else:
             if initial_task.preempted:
                 time_increment -= 1
-
-            if not initial_task.is_idle:
-                self.time_busy += time_increment
-                if type(initial_task) == WorkStealTask or \
-                        type(initial_task) == WorkSearchSpin or type(initial_task) == Task:
-                    self.last_interval_busy_time += time_increment
-
-            if distracted:
-                self.distracted_time += time_increment
-                self.classified_time_step = True
-                self.classification = "Distracted"
-            if initial_task.is_productive:
-                self.task_time += time_increment
-                self.classified_time_step = True
-                self.classification = "Task"
-                self.last_interval_task_time += time_increment
+            self.account_task_time(initial_task, time_increment, distracted)
 
         # If the task was preempted, schedule again
         if initial_task.preempted:
             self.preempted_classification = True
             self.schedule()
 
+    def account_task_time(self, task, time_increment, distracted):
+        """Account for the time spent on a task that took time."""
+        if not task.is_idle:
+            self.time_busy += time_increment
+            if type(task) in INTERVAL_BUSY_TASK_TYPES:
+                self.last_interval_busy_time += time_increment
+
+        if distracted:
+            self.distracted_time += time_increment
+            self.classified_time_step = True
+            self.classification = "Distracted"
+        if task.is_productive:
+            self.task_time += time_increment
+            self.classified_time_step = True
+            self.classification = "Task"
+            self.last_interval_task_time += time_increment
+
+    def continue_task(self, time_increment):
+        """Process the current task for the given amount of time if its type allows it to be advanced through that time
+        (see Task.can_advance) and the thread will not preempt it. The accounting is the same as process_task, but the
+        thread does not need to be scheduled and its next event does not change.
+        :return: True if the task was processed, otherwise the thread must be scheduled
+        """
+        task = self.current_task
+        if task is None or self.enqueue_penalty > 0 or self.fred_preempt or not task.can_advance(time_increment):
+            return False
+
+        distracted = self.is_distracted()
+        task.advance(time_increment)
+        self.account_task_time(task, time_increment, distracted)
+        return True
+
     def schedule(self, time_increment=1):
         """Determine how to spend the thread's time."""
 
@@ -275,8 +333,7 @@ class Thread:
         elif self.work_search_state == WorkSearchState.WORK_STEAL_CHECK:
             # If fred reallocation, check allocation status before allowing a work steal
             if self.config.fred_reallocation and \
-                    self.state.total_queue_occupancy() <= len(self.state.currently_non_productive_cores()) \
-                    and self.current_task != self.state.tasks[0]:
+                    self.state.total_queue_occupancy() <= len(self.state.currently_non_productive_cores()):
                 self.state.deallocate_thread(self.id)
                 return
             elif self.config.oracle_enabled:
@@ -321,7 +378,8 @@ class Thread:
                     self.work_search_state.reset()
                     self.process_task()
 
-    def get_stats(self):
+    def get_stat_values(self):
+        """Return the thread's stats (matching the stat headers) without converting them to strings."""
         stats = [self.id, self.time_busy, self.task_time, self.work_stealing_time, self.work_steal_wait_time,
                  self.enqueue_time, self.requeue_time,
                  self.successful_ws_time, self.unsuccessful_ws_time, self.allocation_time, self.non_work_conserving_time,
@@ -329,7 +387,10 @@ class Thread:
 
         if self.config.delay_flagging_enabled:
             stats += [self.flag_task_time, self.flag_wait_time]
-        stats = [str(x) for x in stats]
+        return stats
+
+    def get_stats(self):
+        stats = [str(x) for x in self.get_stat_values()]
         return stats
 
     @staticmethod
@@ -341,6 +402,11 @@ class Thread:
             headers += ["Flag Task Time", "Flag Wait Time"]
         return headers
 
+    @staticmethod
+    def get_stat_types(config):
+        """Return the binary record type of each stat (matching the stat headers). All but the thread id are times."""
+        return [INT16] + [time_type(config.sim_duration)] * (len(Thread.get_stat_headers(config)) - 1)
+
     def __str__(self):
         if self.work_search_state == WorkSearchState.PARKED:
             return "Thread {} (queue {}): parked".format(self.id, self.queue.id)
@@ -9,11 +9,23 @@ import math
 import sys
 import datetime
 import pathlib
+import pickle
+import shutil
+import sqlite3
+import traceback
 
-from simulation_state import SimulationState
+from simulation_state import SimulationState, REALLOCATION_FILE, REALLOCATION_FORMAT, PARK, ALLOCATE
 from sim_thread import Thread
-from tasks import Task
+from stats_writer import TaskStatsWriter
+from event_trace import EventTrace, TRACE_FILE
+from latency_histogram import HISTOGRAM_FILE
+from record_file import write_record_file, RecordFormat, RecordWriter, RecordCursor, RECORD_FILE_EXTENSION, INT32, \
+    INT16, INT8, time_type
+import run_index
+import event_trace
 import progress_bar as progress
+from phase_profiler import PhaseProfiler, PROFILE_FILE, CHECKPOINT, FIND_TIME_JUMP, ARRIVALS, REALLOCATION, SCHEDULE, \
+    DETERMINE_PAIRINGS
 from sim_config import SimConfig
 
 SINGLE_THREAD_SIM_NAME_FORMAT = "{}_{}"
@@ -21,6 +33,19 @@ MULTI_THREAD_SIM_NAME_FORMAT = "{}_{}_t{}"
 RESULTS_DIR = "{}/results/"
 META_LOG_FILE = "{}/results/meta_log"
 CONFIG_LOG_DIR = "{}/config_records/"
+CHECKPOINT_FILE = "checkpoint.pkl"
+WORK_STEAL_STAT_HEADERS = ["Local Thread", "Remote Thread", "Time Since Last Check", "Queue Length", "Check Count",
+                           "Successful"]
+
+# Parameters that shape the simulation state or open output files when it is initialized, so they cannot be changed
+# by a branch
+BRANCH_FIXED_PARAMETERS = ["name", "num_queues", "num_threads", "mapping", "load_thread_count", "avg_system_load",
+                           "locking_enabled", "event_queue_enabled", "delay_flagging_enabled", "ideal_flag_steal",
+                           "join_bounded_shortest_queue", "trace_enabled", "record_allocations",
+                           "reallocation_replay", "reallocation_record",
+                           "latency_histograms_enabled", "histogram_window", "histogram_warmup", "binary_results",
+                           "workload_trace", "workload_trace_start", "workload_trace_end", "vectorized_workload",
+                           "service_time_distribution", "profile_enabled"]
 
 
 class Simulation:
@@ -30,72 +55,138 @@ class Simulation:
         self.config = configuration
         self.state = SimulationState(configuration)
         self.sim_dir_path = sim_dir_path
-
-    def run(self):
-        """Run the simulation."""
+        self.results_dir = RESULTS_DIR.format(self.sim_dir_path) + "sim_{}/".format(self.config.name)
+
+        # Progress of the run loop (saved in checkpoints)
+        self.reschedule_required = False
+        self.next_checkpoint = None
+        self.profiler = PhaseProfiler() if self.config.profile_enabled else None
+
+    def run(self, stop_time=None):
+        """Run the simulation.
+        :param stop_time: If given, stop at the first time step at or after this time so that the simulation can be
+        continued later (ex. by branching)
+        :return: True if the simulation stopped at the stop time rather than finishing
+        """
 
         # Initialize data
         self.state.initialize_state(self.config)
 
+        # Completed tasks are written out as the simulation runs
+        os.makedirs(os.path.dirname(self.results_dir))
+        self.state.task_writer = TaskStatsWriter(self.results_file("task_times"), self.config)
+        if self.config.trace_enabled:
+            self.state.trace = EventTrace(self.results_dir + TRACE_FILE, self.state.timer)
+        if self.config.record_allocations:
+            self.state.reallocation_writer = RecordWriter(self.results_dir + REALLOCATION_FILE, REALLOCATION_FORMAT)
+
+        # Recorded reallocations are read as they are replayed
+        if self.config.reallocation_replay:
+            self.state.reallocation_replay = RecordCursor(RESULTS_DIR.format(self.sim_dir_path) + "sim_{}/".format(
+                self.config.reallocation_record) + REALLOCATION_FILE)
+
         # A short duration may result in no tasks
-        self.state.tasks_scheduled = len(self.state.tasks)
-        if self.state.tasks_scheduled == 0:
-            return
+        if self.state.arrivals is None or self.state.arrivals.exhausted():
+            return False
 
         # Start at first time stamp with an arrival
-        task_number = 0
-        self.state.timer.increment(self.state.tasks[0].arrival_time)
+        self.state.timer.increment(self.state.arrivals.next_arrival_time())
 
-        allocation_number = 0
-        reschedule_required = False
+        if self.config.checkpoint_interval is not None:
+            self.next_checkpoint = self.state.timer.get_time() + self.config.checkpoint_interval
 
         if self.config.progress_bar:
             print("\nSimulation started")
 
+        return self.run_loop(stop_time=stop_time)
+
+    def resume(self):
+        """Continue a simulation loaded from a checkpoint."""
+        if self.config.progress_bar:
+            print("\nSimulation resumed at {}".format(self.state.timer.get_time()))
+
+        self.run_loop()
+
+    def run_loop(self, stop_time=None):
+        """Run time steps until the simulation is over or the stop time is reached.
+        :return: True if stopped at the stop time
+        """
+        # When profiling, each phase is timed from the end of the previous one
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start_loop(self.state.timer.get_time())
+
         # Run for acceptable time or until all tasks are done
         while self.state.any_incomplete() and \
                 (self.config.sim_duration is None or self.state.timer.get_time() < self.config.sim_duration):
 
+            if stop_time is not None and self.state.timer.get_time() >= stop_time:
+                if profiler is not None:
+                    profiler.stop_loop()
+                return True
+
+            if profiler is not None:
+                profiler.loop_iterations += 1
+                phase_start = profiler.now()
+
+            # Periodically save the state so that the simulation can be resumed
+            if self.next_checkpoint is not None and self.state.timer.get_time() >= self.next_checkpoint:
+                self.save_checkpoint()
+                if profiler is not None:
+                    phase_start = profiler.add(CHECKPOINT, phase_start)
+
             # If fast forwarding, find the time jump
             if self.config.fast_forward_enabled:
-                next_arrival, next_alloc = self.find_next_arrival_and_alloc(task_number, allocation_number)
-                time_jump, reschedule_required = self.find_time_jump(next_arrival, next_alloc,
-                                                                     immediate_reschedule=reschedule_required)
+                next_arrival, next_alloc = self.find_next_arrival_and_alloc()
+                time_jump, self.reschedule_required = self.find_time_jump(
+                    next_arrival, next_alloc, immediate_reschedule=self.reschedule_required)
+                if profiler is not None:
+                    phase_start = profiler.add(FIND_TIME_JUMP, phase_start)
 
-            logging.debug("\n(jump: {}, rr: {})".format(time_jump, reschedule_required))
+            if self.state.debug_logging and self.config.fast_forward_enabled:
+                logging.debug("\n(jump: {}, rr: {})".format(time_jump, self.reschedule_required))
 
             # Put new task arrivals in queues
-            while task_number < self.state.tasks_scheduled and \
-                    self.state.tasks[task_number].arrival_time <= self.state.timer.get_time():
+            while not self.state.arrivals.exhausted() and \
+                    self.state.arrivals.next_arrival_time() <= self.state.timer.get_time():
+                task = self.state.arrivals.pop()
+                self.state.add_task(task)
 
                 if self.config.join_bounded_shortest_queue:
                     chosen_queue = self.state.main_queue
-                    self.state.main_queue.enqueue(self.state.tasks[task_number], set_original=False)
+                    self.state.main_queue.enqueue(task, set_original=False)
 
                 elif self.config.enqueue_choice:
                     chosen_queue = self.choose_enqueue(self.config.ENQUEUE_CHOICES)
                     working_cores = self.state.currently_working_cores()
                     if len(working_cores) == 0:
-                        self.state.tasks[task_number].source_core = self.state.queues[chosen_queue].get_core()
+                        task.source_core = self.state.queues[chosen_queue].get_core()
                     else:
-                        self.state.tasks[task_number].source_core = random.choice(self.state.currently_working_cores())
-                    source_core = self.state.tasks[task_number].source_core
+                        task.source_core = random.choice(self.state.currently_working_cores())
+                    source_core = task.source_core
                     if source_core != chosen_queue:
                         self.state.threads[source_core].enqueue_penalty += 1
                         self.state.queues[chosen_queue].awaiting_enqueue = True
-                        self.state.tasks[task_number].to_enqueue = chosen_queue
-                    self.state.queues[source_core].enqueue(self.state.tasks[task_number], set_original=True)
+                        task.to_enqueue = chosen_queue
+                    self.state.queues[source_core].enqueue(task, set_original=True)
 
                 else:
                     chosen_queue = random.choice(self.state.available_queues)
-                    self.state.queues[chosen_queue].enqueue(self.state.tasks[task_number], set_original=True)
+                    self.state.queues[chosen_queue].enqueue(task, set_original=True)
 
                 if self.config.fred_reallocation and \
                         self.state.threads[self.state.queues[chosen_queue].get_core()].is_busy():
                     self.state.threads[self.state.queues[chosen_queue].get_core()].fred_preempt = True
 
-                logging.debug("[ARRIVAL]: {} onto queue {}".format(self.state.tasks[task_number], chosen_queue))
-                task_number += 1
+                if self.state.trace is not None:
+                    self.state.trace.record(event_trace.ARRIVAL, value=task.service_time,
+                                            target=chosen_queue.id if self.config.join_bounded_shortest_queue
+                                            else chosen_queue)
+                if self.state.debug_logging:
+                    logging.debug("[ARRIVAL]: {} onto queue {}".format(task, chosen_queue))
+
+            if profiler is not None:
+                phase_start = profiler.add(ARRIVALS, phase_start)
 
             # Reallocations
             # Continuously check for reallocations
@@ -110,13 +201,10 @@ class Simulation:
 
             # Reallocation replay
             elif self.config.reallocation_replay:
-                while allocation_number < self.state.reallocations and \
-                        self.state.reallocation_schedule[allocation_number][0] <= self.state.timer.get_time():
-                    if self.state.reallocation_schedule[allocation_number][1]:
-                        self.state.deallocate_thread(self.find_deallocation())
-                    else:
-                        self.state.allocate_thread()
-                    allocation_number += 1
+                while self.state.reallocation_replay.peek() is not None and \
+                        self.state.reallocation_replay.peek()[0] <= self.state.timer.get_time():
+                    self.replay_reallocation(self.state.reallocation_replay.peek())
+                    self.state.reallocation_replay.advance()
 
             # No parking, but still record some stats at reallocation time
             elif not self.config.parking_enabled and self.config.record_allocations and \
@@ -128,9 +216,19 @@ class Simulation:
                     self.state.timer.get_time() % self.config.CORE_REALLOCATION_TIMER == 0:
                 self.state.record_queue_lengths()
 
+            if profiler is not None:
+                phase_start = profiler.add(REALLOCATION, phase_start)
+
             # Schedule threads
             if self.config.fast_forward_enabled:
                 self.fast_forward(time_jump)
+                if profiler is not None:
+                    phase_start = profiler.add(SCHEDULE, phase_start)
+
+                # Record all paired/unpaired time
+                self.determine_pairings(time_jump)
+                if profiler is not None:
+                    profiler.add(DETERMINE_PAIRINGS, phase_start)
             else:
                 # Schedule threads
                 for thread in self.state.threads:
@@ -138,19 +236,137 @@ class Simulation:
 
                 # Move forward in time
                 self.state.timer.increment(1)
+                if profiler is not None:
+                    profiler.add(SCHEDULE, phase_start)
 
             # Log state (in debug mode)
-            logging.debug("\nTime step: {}".format(self.state.timer))
-            logging.debug("Thread status:")
-            for thread in self.state.threads:
-                logging.debug(str(thread) + " -- queue length of " + str(thread.queue.length()))
+            if self.state.debug_logging:
+                logging.debug("\nTime step: {}".format(self.state.timer))
+                logging.debug("Thread status:")
+                for thread in self.state.threads:
+                    logging.debug(str(thread) + " -- queue length of " + str(thread.queue.length()))
 
             # Print progress bar
             if self.config.progress_bar and self.state.timer.get_time() % 10000 == 0:
                 progress.print_progress(self.state.timer.get_time(), self.config.sim_duration, length=50, decimals=3)
 
+        if profiler is not None:
+            profiler.stop_loop()
+
         # When the simulation is complete, record final stats
         self.state.add_final_stats()
+        return False
+
+    def save_checkpoint(self):
+        """Save the whole simulation, including random number generator states and the positions of output files, so
+        that it can be resumed later exactly as if it had not stopped."""
+        while self.next_checkpoint <= self.state.timer.get_time():
+            self.next_checkpoint += self.config.checkpoint_interval
+
+        # Output written so far must be on disk so that the checkpoint can record where it ends
+        self.state.task_writer.sync()
+        if self.state.trace is not None:
+            self.state.trace.flush()
+        if self.state.reallocation_writer is not None:
+            self.state.reallocation_writer.flush()
+
+        checkpoint_path = self.results_dir + CHECKPOINT_FILE
+        checkpoint_file = open(checkpoint_path + ".tmp", "wb")
+        pickle.dump({"simulation": self, "random_state": random.getstate()}, checkpoint_file,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+        checkpoint_file.close()
+        os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+    def branch(self, branches):
+        """Continue the simulation from its current state in one forked child process per branch. Each child changes
+        its own configuration and saves its results under its own name, sharing the state reached so far with the
+        parent copy-on-write. The parent's partial results are removed once all children finish.
+        :param branches: Dictionary from branch name to a dictionary of configuration parameters to change
+        :return: Dictionary from branch name to the exit code of its child process
+        """
+        for changes in branches.values():
+            fixed = [key for key in changes if key in BRANCH_FIXED_PARAMETERS]
+            if len(fixed) > 0:
+                raise ValueError("Branches cannot change {}".format(", ".join(fixed)))
+
+        # Output so far must be in the files before the children copy them
+        self.state.task_writer.sync()
+        if self.state.trace is not None:
+            self.state.trace.flush()
+        if self.state.reallocation_writer is not None:
+            self.state.reallocation_writer.flush()
+        sys.stdout.flush()
+
+        # The random module reseeds itself in forked children, so its state is restored explicitly
+        random_state = random.getstate()
+
+        children = {}
+        for name, changes in branches.items():
+            pid = os.fork()
+            if pid == 0:
+                exit_code = 1
+                try:
+                    random.setstate(random_state)
+                    self.run_branch(name, changes)
+                    exit_code = 0
+                except Exception:
+                    traceback.print_exc()
+                finally:
+                    sys.stdout.flush()
+                    os._exit(exit_code)
+            children[pid] = name
+
+        exit_codes = {}
+        for pid, name in children.items():
+            exit_codes[name] = os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+        self.state.task_writer.close()
+        if self.state.trace is not None:
+            self.state.trace.close()
+        if self.state.reallocation_writer is not None:
+            self.state.reallocation_writer.close()
+        shutil.rmtree(self.results_dir)
+        return exit_codes
+
+    def run_branch(self, name, changes):
+        """Apply a branch's configuration changes, then run the simulation to the end and save results under the
+        branch name. Runs in a forked child process.
+        """
+        for key, value in changes.items():
+            setattr(self.config, key, value)
+        self.config.name = name
+        if not self.config.validate():
+            raise ValueError("Invalid configuration for branch {}".format(name))
+
+        # A branch that changes the checkpoint interval checkpoints from the branch time on (or stops checkpointing)
+        if "checkpoint_interval" in changes:
+            self.next_checkpoint = self.state.timer.get_time() + self.config.checkpoint_interval \
+                if self.config.checkpoint_interval is not None else None
+
+        self.results_dir = RESULTS_DIR.format(self.sim_dir_path) + "sim_{}/".format(name)
+        os.makedirs(os.path.dirname(self.results_dir))
+        self.state.task_writer.copy_to(self.results_file("task_times"))
+        if self.state.trace is not None:
+            self.state.trace.copy_to(self.results_dir + TRACE_FILE)
+        if self.state.reallocation_writer is not None:
+            self.state.reallocation_writer.copy_to(self.results_dir + REALLOCATION_FILE)
+
+        if self.config.progress_bar:
+            print("\nBranch {} started at {}".format(name, self.state.timer.get_time()))
+        self.run_loop()
+        self.save_stats()
+
+    @staticmethod
+    def load_checkpoint(checkpoint_path):
+        """Load a simulation saved by save_checkpoint. Output files are truncated to their state at the checkpoint."""
+        checkpoint_file = open(checkpoint_path, "rb")
+        checkpoint = pickle.load(checkpoint_file)
+        checkpoint_file.close()
+
+        random.setstate(checkpoint["random_state"])
+        simulation = checkpoint["simulation"]
+        simulation.state.debug_logging = logging.getLogger().isEnabledFor(logging.DEBUG)
+        return simulation
 
     def choose_enqueue(self, num_choices):
         """Choose a queue to place a new task on by current queueing delay."""
@@ -282,6 +498,19 @@ class Simulation:
         else:
             self.state.add_reallocation(None)
 
+    def replay_reallocation(self, record):
+        """Repeat a recorded reallocation. With multiple queues, the recorded thread is parked or allocated if possible so
+        that the same queues are served.
+        :param record: Record from the reallocation record file
+        """
+        action, thread_id = record[1], record[3]
+        replay_thread = self.config.num_queues > 1 and thread_id >= 0
+        if action == PARK:
+            self.state.deallocate_thread(thread_id if replay_thread and thread_id not in self.state.parked_threads
+                                         else self.find_deallocation())
+        elif action == ALLOCATE:
+            self.state.allocate_thread(thread_id if replay_thread else None)
+
     def find_deallocation(self):
         """Find a core to deallocate from all non-parked cores. Preference is given to idle or soon-to-be-idle cores."""
         free_threads = set(range(self.config.num_threads)).difference(self.state.parked_threads)
@@ -301,16 +530,13 @@ class Simulation:
 
         return choice
 
-    def find_next_arrival_and_alloc(self, task_number, allocation_number):
-        """Determine the next task arrival and allocation decision.
-        :param task_number: Current index into tasks that have arrived.
-        :param allocation_number: Current allocation index into schedule if in replay.
-        """
-        next_arrival = self.state.tasks[task_number].arrival_time if task_number < self.state.tasks_scheduled else None
+    def find_next_arrival_and_alloc(self):
+        """Determine the next task arrival and allocation decision."""
+        next_arrival = self.state.arrivals.next_arrival_time()
         next_alloc = None
 
-        if self.config.reallocation_replay and allocation_number < self.state.reallocations:
-            next_alloc = self.state.reallocation_schedule[allocation_number][0]
+        if self.config.reallocation_replay and self.state.reallocation_replay.peek() is not None:
+            next_alloc = self.state.reallocation_replay.peek()[0]
 
         elif self.config.always_check_realloc:
             if self.config.delay_range_enabled:
@@ -332,8 +558,7 @@ class Simulation:
                 time_until_threshold_passed = 0
 
             else:
-                current_delays = [x.current_delay() for x in self.state.queues]
-                time_until_threshold_passed = self.config.ALLOCATION_THRESHOLD - max(current_delays)
+                time_until_threshold_passed = self.config.ALLOCATION_THRESHOLD - self.state.max_queueing_delay()
             next_alloc = self.state.timer.get_time() + time_until_threshold_passed \
                 if time_until_threshold_passed > 0 else None
 
@@ -360,16 +585,24 @@ class Simulation:
         (ie. completing a task)
         """
         # Find the next task completion time
-        completion_times = []
-        for thread in self.state.threads:
-            if thread.current_task is not None and not thread.current_task.is_idle:
-                completion_times.append(thread.current_task.expected_completion_time())
+        if self.state.completion_events is not None:
+            next_completion_time = self.state.completion_events.next_time()
 
-                # If a task completed now but immediate reschedule missed (ex. service time of 1), next jump must be 1
-                if thread.last_complete == self.state.timer.get_time():
-                    immediate_reschedule = True
+            # If a task completed now but immediate reschedule missed (ex. service time of 1), next jump must be 1
+            if self.state.last_task_completion == self.state.timer.get_time():
+                immediate_reschedule = True
+
+        else:
+            completion_times = []
+            for thread in self.state.threads:
+                if thread.current_task is not None and not thread.current_task.is_idle:
+                    completion_times.append(thread.current_task.expected_completion_time())
 
-        next_completion_time = min(completion_times) if len(completion_times) > 0 else None
+                    # If a task completed now but immediate reschedule missed (ex. service time of 1), next jump must be 1
+                    if thread.last_complete == self.state.timer.get_time():
+                        immediate_reschedule = True
+
+            next_completion_time = min(completion_times) if len(completion_times) > 0 else None
 
         # Find the next event of any type
         upcoming_events = [next_arrival, next_completion_time, next_allocation]
@@ -400,12 +633,18 @@ class Simulation:
         return jump, reschedule_required
 
     def fast_forward(self, jump):
-        """Fast forward through uneventful timesteps."""
+        """Fast forward through uneventful timesteps. Paired/unpaired time is recorded separately by
+        determine_pairings."""
         for thread in self.state.threads:
+            # Threads whose task continues through the jump only need their time accounted
+            if thread.continue_task(jump):
+                continue
             thread.schedule(time_increment=jump)
+
+            # Only the thread itself changes its current task, so its next event is known once it is scheduled
+            if self.state.completion_events is not None:
+                self.state.update_completion_event(thread)
         # self.state.timer.increment(jump)
-        # Record all paired/unpaired time
-        self.determine_pairings(jump)
 
     def determine_pairings(self, jump):
         """Determine how to pair cores for accounting of how well they are spending their time."""
@@ -428,60 +667,125 @@ class Simulation:
             else:
                 thread.add_unpaired_time(increment)
 
+    def results_file(self, name):
+        """Return the path of a results file, which is binary if binary results are enabled and CSV otherwise."""
+        return self.results_dir + name + (RECORD_FILE_EXTENSION if self.config.binary_results else ".csv")
+
     def save_stats(self):
         """Save simulation date to file."""
-        # Make files and directories
-        new_dir_name = RESULTS_DIR.format(self.sim_dir_path) + "sim_{}/".format(self.config.name)
-        os.makedirs(os.path.dirname(new_dir_name))
-        cpu_file = open("{}cpu_usage.csv".format(new_dir_name, self.config.name), "w")
-        task_file = open("{}task_times.csv".format(new_dir_name, self.config.name), "w")
+        # Make files (the directory is created when the simulation starts)
+        new_dir_name = self.results_dir
         meta_file = open("{}meta.json".format(new_dir_name), "w")
         stats_file = open("{}stats.json".format(new_dir_name), "w")
 
         # Write CPU information
-        cpu_file.write(','.join(Thread.get_stat_headers(self.config)) + "\n")
-        for thread in self.state.threads:
-            cpu_file.write(','.join(thread.get_stats()) + "\n")
-        cpu_file.close()
-
-        # Write task information
-        task_file.write(','.join(Task.get_stat_headers(self.config)) + "\n")
-        for task in self.state.tasks:
-            task_file.write(','.join(task.get_stats()) + "\n")
-        task_file.close()
+        if self.config.binary_results:
+            write_record_file(self.results_file("cpu_usage"), RecordFormat(Thread.get_stat_headers(self.config),
+                                                                            Thread.get_stat_types(self.config)),
+                              [thread.get_stat_values() for thread in self.state.threads])
+        else:
+            cpu_file = open(self.results_file("cpu_usage"), "w")
+            cpu_file.write(','.join(Thread.get_stat_headers(self.config)) + "\n")
+            for thread in self.state.threads:
+                cpu_file.write(','.join(thread.get_stats()) + "\n")
+            cpu_file.close()
+
+        # Write remaining task information (completed tasks were written during the simulation)
+        for queue in self.state.queues:
+            queue.record_all_checks()
+        for task in self.state.active_tasks:
+            self.state.task_writer.add(task)
+        self.state.task_writer.close()
+        if self.state.trace is not None:
+            self.state.trace.close()
+        if self.state.reallocation_writer is not None:
+            self.state.reallocation_writer.close()
+
+        # The results are complete, so the simulation no longer needs to be resumable
+        if os.path.isfile(new_dir_name + CHECKPOINT_FILE):
+            os.remove(new_dir_name + CHECKPOINT_FILE)
 
         # Save the configuration
         json.dump(self.config.__dict__, meta_file, indent=0)
         meta_file.close()
 
         # Save global stats
-        json.dump(self.state.results(), stats_file, indent=0)
+        stats = self.state.results()
+        json.dump(stats, stats_file, indent=0)
         stats_file.close()
 
+        # Save the profile of the simulation loop
+        if self.profiler is not None:
+            self.profiler.save(new_dir_name + PROFILE_FILE, self.state)
+
+        # Save latency histograms
+        if self.config.latency_histograms_enabled:
+            self.state.latency_recorder.save(new_dir_name + HISTOGRAM_FILE)
+
         # If recording work steal stats, save
-        if self.config.record_steals:
-            ws_file = open("{}work_steal_stats.csv".format(new_dir_name), "w")
-            ws_file.write("Local Thread,Remote Thread,Time Since Last Check,Queue Length,Check Count,Successful\n")
+        if self.config.record_steals and self.config.binary_results:
+            write_record_file(self.results_file("work_steal_stats"),
+                              RecordFormat(WORK_STEAL_STAT_HEADERS, [INT16, INT16, time_type(self.config.sim_duration),
+                                                                     INT32, INT32, INT8]),
+                              [check[:5] + (int(check[5]),) for check in self.state.ws_checks])
+        elif self.config.record_steals:
+            ws_file = open(self.results_file("work_steal_stats"), "w")
+            ws_file.write(",".join(WORK_STEAL_STAT_HEADERS) + "\n")
             for check in self.state.ws_checks:
                 ws_file.write("{},{},{},{},{},{}\n".format(check[0], check[1], check[2], check[3], check[4], check[5]))
             ws_file.close()
 
-        # If recording allocations, save
-        if self.config.record_allocations:
-            realloc_sched_file = open("{}realloc_schedule".format(new_dir_name), "w")
-            realloc_sched_file.write(str(self.state.reallocation_schedule))
-            realloc_sched_file.close()
-
         # If recording queue lengths, save
-        if self.config.record_queue_lens:
-            qlen_file = open("{}queue_lens.csv".format(new_dir_name), "w")
+        if self.config.record_queue_lens and self.config.binary_results:
+            write_record_file(self.results_file("queue_lens"),
+                              RecordFormat(["Queue {}".format(x.id) for x in self.state.queues],
+                                           [time_type(self.config.sim_duration)] * len(self.state.queues),
+                                           csv_header=False),
+                              self.state.queue_lens)
+        elif self.config.record_queue_lens:
+            qlen_file = open(self.results_file("queue_lens"), "w")
             for lens in self.state.queue_lens:
                 qlen_file.write(",".join([str(x) for x in lens]) + "\n")
             qlen_file.close()
 
+        # Add the run to the index of saved runs (the results are complete even if this fails). Without latency
+        # histograms, the tail latencies are computed from the task times written above, as when rebuilding the index.
+        if self.state.latency_recorder is not None:
+            latency_histogram = self.state.latency_recorder.overall
+        else:
+            latency_histogram = run_index.run_latency_histogram(new_dir_name, self.config.__dict__)
+        try:
+            run_index.add_run(RESULTS_DIR.format(self.sim_dir_path),
+                              run_index.run_record(self.config.__dict__, stats, latency_histogram, new_dir_name))
+        except sqlite3.Error as e:
+            print("Could not add {} to the run index: {}".format(self.config.name, e))
+
 
 if __name__ == "__main__":
 
+    # Resume an interrupted simulation from its checkpoint
+    if "--resume" in sys.argv:
+        if "-d" in sys.argv:
+            logging.basicConfig(level=logging.DEBUG, format='%(levelname)s:%(message)s')
+            sys.argv.remove("-d")
+
+        resume_index = sys.argv.index("--resume") + 1
+        if resume_index >= len(sys.argv) or not os.path.isfile(sys.argv[resume_index]):
+            print("Checkpoint file not found.")
+            exit(1)
+
+        sim = Simulation.load_checkpoint(sys.argv[resume_index])
+        sim.resume()
+        sim.save_stats()
+
+        # The original config file may no longer exist, so record the loaded configuration
+        if not(os.path.isdir(CONFIG_LOG_DIR.format(sim.sim_dir_path))):
+            os.makedirs(CONFIG_LOG_DIR.format(sim.sim_dir_path))
+        config_record = open(CONFIG_LOG_DIR.format(sim.sim_dir_path) + sim.config.name + ".json", "w")
+        json.dump(sim.config.__dict__, config_record, indent=0)
+        config_record.close()
+        exit(0)
+
     run_name = SINGLE_THREAD_SIM_NAME_FORMAT.format(os.uname().nodename,
                                                     datetime.datetime.now().strftime("%y-%m-%d_%H:%M:%S"))
     path_to_sim = os.path.relpath(pathlib.Path(__file__).resolve().parents[1], start=os.curdir)
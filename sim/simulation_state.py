@@ -1,16 +1,35 @@
 #!/usr/bin/env python
 """Object to maintain simulation state."""
 
+import logging
 import math
 import datetime
 import random
 
 from timer import Timer
 from work_search_state import WorkSearchState
-from tasks import EnqueuePenaltyTask, Task
+from tasks import EnqueuePenaltyTask
 from sim_thread import Thread
 from sim_queue import Queue
-import progress_bar as progress
+from event_queue import EventQueue
+import event_trace
+from flag_helpers import FlagHelperIndex
+from latency_histogram import LatencyRecorder
+from arrivals import TaskArrivals, VectorizedTaskArrivals, TraceArrivals
+from record_file import RecordFormat, RecordCursor, RECORD_FILE_EXTENSION, INT32, INT64
+
+POLICY_SEED_FORMAT = "{}_policy"
+
+# Record of reallocation decisions, written with record_allocations and read back by reallocation replays
+REALLOCATION_FILE = "realloc_schedule" + RECORD_FILE_EXTENSION
+REALLOCATION_FORMAT = RecordFormat(["Time", "Action", "Attempted", "Thread", "Queue Occupancy", "Work in System",
+                                    "Cores"], [INT64, INT32, INT32, INT32, INT32, INT64, INT32])
+
+# Reallocation record actions
+ALLOCATE = 0
+PARK = 1
+NO_CHANGE = -1
+CHECK_IN = -2
 
 
 class SimulationState:
@@ -21,12 +40,37 @@ class SimulationState:
         self.timer = Timer()
         self.threads = []
         self.queues = []
-        self.tasks = []
+        self.active_tasks = {}  # Tasks that have arrived but not completed (as keys, in arrival order)
+        self.arrivals = None
+        self.task_writer = None
+        self.trace = None
+        self.latency_recorder = None
+        # Checked before building debug messages so that their formatting is skipped when not logging
+        self.debug_logging = logging.getLogger().isEnabledFor(logging.DEBUG)
         self.parked_threads = []
         self.available_queues = []
         self.allocating_threads = []
         self.main_queue = None
 
+        # Event indices (only maintained when the event queue is enabled)
+        self.completion_events = EventQueue() if config.event_queue_enabled else None
+        self.queue_heads = EventQueue() if config.event_queue_enabled else None
+        self.last_task_completion = None
+        self.flag_helpers = FlagHelperIndex(config.num_threads, config.ideal_flag_steal) \
+            if config.event_queue_enabled and config.delay_flagging_enabled else None
+
+        # Running totals across all queues (excluding the main queue)
+        self.queued_task_count = 0
+        self.queued_service_time = 0
+        self.head_arrival_sum = 0
+
+        # Work-available index: IDs of queues with tasks and, with locking, of those that are also unlocked
+        self.nonempty_queues = set()
+        self.stealable_queues = set()
+
+        # Number of times every queue with tasks was checked at once (ex. by the oracle)
+        self.queue_sweep_count = 0
+
         # Global stats
         self.overall_steal_count = 0
         self.flag_steal_count = 0
@@ -46,8 +90,8 @@ class SimulationState:
         self.sim_end_time = None
 
         # Optional stats
-        self.reallocation_schedule = []
-        self.reallocations = 0
+        self.reallocation_writer = None
+        self.reallocation_replay = None
         self.ws_checks = []
         self.queue_lens = []
 
@@ -57,7 +101,95 @@ class SimulationState:
 
     def any_queue_past_delay_threshold(self):
         """Returns true if any queue has a queueing delay longer than the reallocation interval."""
-        return any([x.current_delay() > self.config.ALLOCATION_THRESHOLD for x in self.queues])
+        return self.max_queueing_delay() > self.config.ALLOCATION_THRESHOLD
+
+    def max_queueing_delay(self):
+        """Returns the longest current queueing delay of any queue."""
+        if self.queue_heads is not None:
+            oldest_arrival = self.queue_heads.next_time()
+            return max(self.timer.get_time() - oldest_arrival, 0) if oldest_arrival is not None else 0
+        return max([x.current_delay() for x in self.queues])
+
+    def update_queue_totals(self, count, service_time):
+        """Update the running totals of queued tasks and service time."""
+        self.queued_task_count += count
+        self.queued_service_time += service_time
+
+    def update_queue_head(self, queue_id, previous_arrival, arrival):
+        """Update the head-of-line totals (and index, if enabled) when the head of a queue changes.
+        :param queue_id: ID of the queue
+        :param previous_arrival: Arrival time of the previous head or None if the queue was empty
+        :param arrival: Arrival time of the new head or None if the queue is now empty
+        """
+        if previous_arrival is not None:
+            self.head_arrival_sum -= previous_arrival
+            if arrival is None:
+                self.nonempty_queues.discard(queue_id)
+        if arrival is not None:
+            self.head_arrival_sum += arrival
+            if previous_arrival is None:
+                self.nonempty_queues.add(queue_id)
+        if self.queue_heads is not None:
+            self.queue_heads.update(queue_id, arrival)
+
+    def update_stealable_queue(self, queue_id, stealable):
+        """Update the work-available index after a queue's tasks or lock change.
+        :param queue_id: ID of the queue
+        :param stealable: True if the queue has tasks and is unlocked
+        """
+        if stealable:
+            self.stealable_queues.add(queue_id)
+        else:
+            self.stealable_queues.discard(queue_id)
+
+    def any_work_available(self):
+        """Returns true if any queue has work available."""
+        if self.config.verify_queue_totals:
+            self.check_total("Work available", self.work_available_in_index(),
+                             any(q.work_available() for q in self.queues))
+        return self.work_available_in_index()
+
+    def work_available_in_index(self):
+        """Returns true if the work-available index has any queue with work."""
+        # With bounded queues, every queue reports work while the main queue has tasks
+        if self.config.join_bounded_shortest_queue and self.main_queue.length() > 0:
+            return True
+        return len(self.nonempty_queues) > 0
+
+    def any_work_available_to(self, thread_id):
+        """Returns true if any queue has work available and a lock the thread could acquire.
+        :param thread_id: ID of the thread looking for work
+        """
+        if not self.config.locking_enabled:
+            return self.any_work_available()
+        if self.config.join_bounded_shortest_queue and self.main_queue.length() > 0:
+            return any(q.try_get_lock(thread_id, get_lock=False) for q in self.queues)
+        # Any unlocked queue with tasks will do, otherwise only locked queues with tasks need checking
+        return len(self.stealable_queues) > 0 or \
+            any(self.queues[x].try_get_lock(thread_id, get_lock=False) for x in self.nonempty_queues)
+
+    def oldest_queue(self, exclude=None):
+        """Returns the queue whose head task arrived first or None if all queues are empty.
+        Ties go to the queue with the lowest ID.
+        :param exclude: ID of a queue to leave out
+        """
+        event = self.queue_heads.peek(exclude=exclude)
+        return self.queues[event[1]] if event is not None else None
+
+    def check_total(self, name, total, expected):
+        """Compare a running total to its recomputed value when verifying queue totals."""
+        if total != expected:
+            raise RuntimeError("{} total is {} but recomputing gives {} at time {}".format(name, total, expected,
+                                                                                         self.timer.get_time()))
+
+    def update_completion_event(self, thread):
+        """Update the event queue with the next completion time of the thread."""
+        completion_time = thread.next_completion_time()
+        self.completion_events.update(thread.id, completion_time)
+
+        # A task completed in this time step requires the next jump to be 1
+        if completion_time is not None and thread.last_complete == self.timer.get_time():
+            self.last_task_completion = self.timer.get_time()
 
     def currently_working_cores(self):
         """Returns the cores currently working on something productive."""
@@ -150,17 +282,15 @@ class SimulationState:
     def current_average_queueing_delay(self):
         """Return the current average queueing delay across all queues."""
         # Consider non-available queues since cores can be forced to park with tasks
-        total_queue_time = 0
-        for queue in self.queues:
-            total_queue_time += queue.current_delay()
+        total_queue_time = len(self.nonempty_queues) * self.timer.get_time() - self.head_arrival_sum
+        if self.config.verify_queue_totals:
+            self.check_total("Queueing delay", total_queue_time, sum([queue.current_delay() for queue in self.queues]))
         return total_queue_time / len(self.available_queues)
 
     def current_average_service_time_sum(self):
         """Return the current average queueing delay across all queues."""
         # Consider non-available queues since cores can be forced to park with tasks
-        total_service_time_left = 0
-        for queue in self.queues:
-            total_service_time_left += queue.length_by_service_time()
+        total_service_time_left = self.total_queued_service_time()
         for thread in self.threads:
             if thread.is_productive():
                 total_service_time_left += thread.current_task.time_left
@@ -184,16 +314,30 @@ class SimulationState:
 
     def any_incomplete(self):
         """Return true if there are any incomplete tasks for the entire simulation."""
-        return self.complete_task_count < self.tasks_scheduled
+        return self.complete_task_count < self.tasks_scheduled or not self.arrivals.exhausted()
+
+    def add_task(self, task):
+        """Track a task that has arrived until it completes."""
+        self.active_tasks[task] = None
+        self.tasks_scheduled += 1
+
+    def complete_task(self, task):
+        """Stop tracking a completed task and hand it off to be written."""
+        self.complete_task_count += 1
+        del self.active_tasks[task]
+        if self.latency_recorder is not None:
+            self.latency_recorder.record(task.arrival_time, task.time_in_system())
+        if self.task_writer is not None:
+            self.task_writer.add(task)
 
     def record_ws_check(self, local_id, remote, check_count, successful=False):
         """Record a work steal check on a queue to see if it can be stolen from."""
         if self.config.record_steals:
             if not successful:
-                self.ws_checks.append((local_id, remote.id, self.state.timer.get_time() - remote.last_ws_check,
+                self.ws_checks.append((local_id, remote.id, self.timer.get_time() - remote.last_ws_check,
                                        remote.length(), check_count, False))
             else:
-                self.ws_checks[-1] = (local_id, remote.id, self.state.timer.get_time() - remote.last_ws_check,
+                self.ws_checks[-1] = (local_id, remote.id, self.timer.get_time() - remote.last_ws_check,
                                       remote.length(), check_count, True)
 
     def record_queue_lengths(self):
@@ -202,28 +346,27 @@ class SimulationState:
             # self.queue_lens.append([x.length() for x in self.queues])
             self.queue_lens.append([x.current_delay() for x in self.queues])
 
-    def add_reallocation(self, is_park, attempted=False):
+    def add_reallocation(self, is_park, attempted=False, thread_id=None):
         """Record a reallocation.
-        :param is_park: True if the reallocation was a park, otherwise false.
+        :param is_park: True if the reallocation was a park, False if an allocation, None if no change was made.
+        :param attempted: True if no thread was available to park or allocate.
+        :param thread_id: ID of the thread parked or allocated, if any.
         """
-        if self.config.record_allocations:
-            if self.config.buffer_cores_enabled:
-                self.reallocation_schedule.append(
-                    (self.timer.get_time(), is_park, int(attempted), self.total_queue_occupancy(),
-                     self.total_work_in_system(), len(self.current_buffer_cores())))
-            else:
-                self.reallocation_schedule.append((self.timer.get_time(), is_park, int(attempted),
-                                                   self.total_queue_occupancy(), self.total_work_in_system()))
+        if self.reallocation_writer is not None:
+            action = NO_CHANGE if is_park is None else PARK if is_park else ALLOCATE
+            self.reallocation_writer.add((self.timer.get_time(), action, int(attempted),
+                                          thread_id if thread_id is not None else -1, self.total_queue_occupancy(),
+                                          self.total_work_in_system(),
+                                          len(self.current_buffer_cores()) if self.config.buffer_cores_enabled else -1))
 
     def add_realloc_time_check_in(self):
         """Record time, cores working, and core occupancy."""
-        self.reallocation_schedule.append((self.timer.get_time(), self.num_currently_working_cores(),
-                                           self.total_queue_occupancy(), self.total_work_in_system()))
+        self.reallocation_writer.add((self.timer.get_time(), CHECK_IN, 0, -1, self.total_queue_occupancy(),
+                                      self.total_work_in_system(), self.num_currently_working_cores()))
 
     def add_final_stats(self):
         """Add final global stats to to the simulation state."""
         self.end_time = self.timer.get_time()
-        self.tasks_scheduled = len(self.tasks)
         self.sim_end_time = datetime.datetime.now().strftime("%y-%m-%d_%H:%M:%S")
 
     def results(self):
@@ -236,19 +379,24 @@ class SimulationState:
                  "Number Allocations": self.allocations}
         return stats
 
-    def allocate_thread(self):
-        """Allocate a parked thread."""
+    def allocate_thread(self, thread_id=None):
+        """Allocate a parked thread.
+        :param thread_id: Thread to allocate if it is parked (ex. when replaying a recorded allocation), otherwise one is
+        chosen
+        """
         if not self.threads_available_for_allocation():
             self.add_reallocation(False, attempted=True)
             return None
 
+        if thread_id is not None and thread_id in self.parked_threads:
+            chosen_thread = thread_id
         # If all cores are parked, allocate the most recently parked one so that it is mapped to the active queue
-        if len(self.parked_threads) == self.config.num_threads:
+        elif len(self.parked_threads) == self.config.num_threads:
             chosen_thread = self.queues[self.available_queues[0]].get_core()
         else:
             chosen_thread = max(self.parked_threads)
         self.threads[chosen_thread].scheduled_dealloc = False
-        self.add_reallocation(False)
+        self.add_reallocation(False, thread_id=chosen_thread)
         self.parked_threads.remove(chosen_thread)
 
         if not self.config.allocation_delay:
@@ -261,19 +409,23 @@ class SimulationState:
 
         self.allocations += 1
         self.last_realloc_choice = self.timer.get_time()
+        if self.trace is not None:
+            self.trace.record(event_trace.ALLOCATE, chosen_thread, self.threads[chosen_thread].queue.id)
         return chosen_thread
 
     def deallocate_thread(self, thread_id):
         """Park the specified thread."""
         if not self.threads_available_for_deallocation():
-            self.add_reallocation(True, attempted=True)
+            self.add_reallocation(True, attempted=True, thread_id=thread_id)
             return
 
         self.park_count += 1
-        self.add_reallocation(True)
+        self.add_reallocation(True, thread_id=thread_id)
         self.last_realloc_choice = self.timer.get_time()
 
         self.parked_threads.append(thread_id)
+        if self.trace is not None:
+            self.trace.record(event_trace.PARK, thread_id, self.threads[thread_id].queue.id)
 
         # Make the queue unavailable if there's more than one queue, the queue is available, and
         # all of its threads are parked
@@ -297,16 +449,20 @@ class SimulationState:
 
     def total_queue_occupancy(self):
         """Return the total queue occupancy across all queues."""
-        total = 0
-        for q in self.queues:
-            total += q.length()
-        return total
+        if self.config.verify_queue_totals:
+            self.check_total("Queue occupancy", self.queued_task_count, sum([q.length() for q in self.queues]))
+        return self.queued_task_count
+
+    def total_queued_service_time(self):
+        """Return the sum of service times of all queued tasks."""
+        if self.config.verify_queue_totals:
+            self.check_total("Queued service time", self.queued_service_time,
+                             sum([q.length_by_service_time() for q in self.queues]))
+        return self.queued_service_time
 
     def total_work_in_system(self):
         """Return the total work in the system."""
-        total = 0
-        for q in self.queues:
-            total += q.length_by_service_time()
+        total = self.total_queued_service_time()
         for thread in self.threads:
             if thread.is_productive():
                 total += thread.current_task.time_left
@@ -323,17 +479,9 @@ class SimulationState:
             return
 
         # Set random seed based on run name
-        if config.reallocation_replay:
-            random.seed(config.reallocation_record)
-        else:
-            random.seed(config.name)
-
-        # Set reallocation schedule if replaying one
-        if config.reallocation_replay:
-            record_file = open("./results/sim_{}/realloc_schedule".format(config.reallocation_record), "r")
-            self.reallocation_schedule = eval(record_file.read())
-            self.reallocations = len(self.reallocation_schedule)
-            record_file.close()
+        # The workload is drawn from its own generator with this seed so that it does not depend on policy decisions
+        seed = config.reallocation_record if config.reallocation_replay else config.name
+        random.seed(POLICY_SEED_FORMAT.format(seed))
 
         # Initialize queues
         for i in range(len(set(config.mapping))):
@@ -358,29 +506,19 @@ class SimulationState:
             else:
                 self.threads[i].sibling = self.threads[i - 1]
 
-        # Set tasks and arrival times
-        request_rate = config.avg_system_load * config.load_thread_count / config.AVERAGE_SERVICE_TIME
-        next_task_time = int(1/request_rate) if config.regular_arrivals else int(random.expovariate(request_rate))
-        if config.bimodal_service_time:
-            distribution = [500] * 9 + [5500]
-        i = 0
-        while (config.sim_duration is None or next_task_time < config.sim_duration) and \
-                (config.num_tasks is None or i < config.num_tasks):
-            service_time = None
-            while service_time is None or service_time == 0:
-                if config.constant_service_time:
-                    service_time = config.AVERAGE_SERVICE_TIME
-                elif config.bimodal_service_time:
-                    service_time = random.choice(distribution)
-                else:
-                    service_time = int(random.expovariate(1 / config.AVERAGE_SERVICE_TIME))
-
-            self.tasks.append(Task(service_time, next_task_time, config, self))
-            if config.regular_arrivals:
-                next_task_time += int(1 / request_rate)
-            else:
-                next_task_time += int(random.expovariate(request_rate))
+        if self.flag_helpers is not None:
+            for thread in self.threads:
+                self.flag_helpers.update(thread)
+
+        # The warm-up is a fraction of the simulation duration, matching the time dropped in analysis
+        if config.latency_histograms_enabled:
+            warmup_time = config.histogram_warmup * config.sim_duration if config.sim_duration is not None else 0
+            self.latency_recorder = LatencyRecorder(warmup_time, config.histogram_window)
 
-            if config.progress_bar and i % 100 == 0:
-                progress.print_progress(next_task_time, config.sim_duration, decimals=3, length=50)
-            i += 1
+        # Tasks are generated (or read from the workload trace) lazily as the simulation reaches their arrival times
+        if config.workload_trace is not None:
+            self.arrivals = TraceArrivals(config, self)
+        elif config.vectorized_workload:
+            self.arrivals = VectorizedTaskArrivals(config, self, seed)
+        else:
+            self.arrivals = TaskArrivals(config, self, seed)
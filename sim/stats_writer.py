@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""Background writer for per-task statistics."""
+
+import queue
+import struct
+import threading
+
+from tasks import Task
+from record_file import RecordFormat
+
+
+class TaskStatsWriter:
+    """Writes task records to the task times file in fixed-size chunks from a dedicated I/O thread, so that completed
+    tasks do not need to be kept until the end of the simulation. Records are written as CSV text or, if binary results
+    are enabled, as fixed-width binary records."""
+
+    CHUNK_SIZE = 10000
+
+    # Maximum number of full chunks waiting to be written before the simulation blocks
+    MAX_PENDING_CHUNKS = 8
+
+    def __init__(self, file_path, config, chunk_size=CHUNK_SIZE):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.records_written = 0
+        self.binary = config.binary_results
+
+        if self.binary:
+            self.record_format = RecordFormat(Task.get_stat_headers(config), Task.get_stat_types(config))
+            self.file = open(file_path, "wb")
+            self.record_format.write_header(self.file)
+        else:
+            self.record_format = None
+            self.file = open(file_path, "w")
+            self.file.write(','.join(Task.get_stat_headers(config)) + "\n")
+
+        self.start()
+
+    def start(self):
+        """Start the writer thread with no pending records."""
+        self.chunk = []
+        self.pending = queue.Queue(maxsize=self.MAX_PENDING_CHUNKS)
+        self.error = None
+        self.thread = threading.Thread(target=self.write_chunks, daemon=True)
+        self.thread.start()
+
+    def add(self, task):
+        """Add the record of a task to the current chunk and hand the chunk off once full."""
+        self.chunk.append(task.get_stat_values())
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Hand the current chunk to the writer thread."""
+        if len(self.chunk) > 0:
+            self.pending.put(self.chunk)
+            self.chunk = []
+
+    def write_chunks(self):
+        """Write chunks as they arrive until the end marker (None) is received."""
+        while True:
+            chunk = self.pending.get()
+            if chunk is None:
+                self.pending.task_done()
+                break
+            if self.error is None:
+                try:
+                    if self.binary:
+                        self.file.write(self.record_format.pack_rows(chunk))
+                    else:
+                        self.file.write("".join([','.join([str(x) for x in record]) + "\n" for record in chunk]))
+                    self.records_written += len(chunk)
+                except (OSError, struct.error) as e:
+                    self.error = e
+            self.pending.task_done()
+
+    def sync(self):
+        """Write all records added so far to the file and wait until they reach the operating system."""
+        self.flush()
+        self.pending.join()
+        if self.error is not None:
+            raise self.error
+        self.file.flush()
+
+    def copy_to(self, file_path):
+        """Copy the records written so far to a new file and continue writing there (ex. in a forked child process).
+        The writer must be synced first. Its thread is restarted since threads do not survive a fork.
+        """
+        offset = self.file.tell()
+        self.file.close()
+        with open(self.file_path, "rb") as source, open(file_path, "wb") as copy:
+            copy.write(source.read(offset))
+
+        self.file_path = file_path
+        self.file = open(file_path, "ab" if self.binary else "a")
+        self.start()
+
+    def __getstate__(self):
+        """Save the writer as the position in the file it has written up to. The writer must be synced first."""
+        return {"file_path": self.file_path, "chunk_size": self.chunk_size, "records_written": self.records_written,
+                "binary": self.binary, "record_format": self.record_format, "offset": self.file.tell()}
+
+    def __setstate__(self, checkpoint):
+        """Reopen the file, dropping anything written after the checkpoint, and restart the writer thread."""
+        self.file_path = checkpoint["file_path"]
+        self.chunk_size = checkpoint["chunk_size"]
+        self.records_written = checkpoint["records_written"]
+        self.binary = checkpoint["binary"]
+        self.record_format = checkpoint["record_format"]
+
+        self.file = open(self.file_path, "r+b" if self.binary else "r+")
+        self.file.truncate(checkpoint["offset"])
+        self.file.seek(checkpoint["offset"])
+
+        self.start()
+
+    def close(self):
+        """Write any remaining records, wait for the writer thread to finish and close the file."""
+        self.flush()
+        self.pending.put(None)
+        self.thread.join()
+        self.file.close()
+        if self.error is not None:
+            raise self.error
@@ -5,11 +5,19 @@ import math
 import random
 import logging
 from work_search_state import WorkSearchState
+import event_trace
+from record_file import INT32, INT16, INT8, time_type
 
 
 class Task:
     """Task to be completed by a thread."""
 
+    __slots__ = ("source_core", "service_time", "time_left", "complete", "arrival_time", "start_time", "completion_time",
+                 "original_queue", "requeue_time", "steal_count", "flag_steal_count", "is_idle", "is_productive",
+                 "is_overhead", "preempted", "queued_ahead", "total_queue", "queue_checks", "check_epoch", "remote",
+                 "flag_wait_time", "flag_set_delay", "flagged", "flagged_time_left", "to_enqueue", "front_task_time",
+                 "config", "state")
+
     def __init__(self, time, arrival_time, config, state):
         self.source_core = None
         self.service_time = time
@@ -29,6 +37,7 @@ class Task:
         self.queued_ahead = None
         self.total_queue = None
         self.queue_checks = 0
+        self.check_epoch = 0
         self.remote = None
         self.flag_wait_time = 0
         self.flag_set_delay = 0
@@ -52,7 +61,7 @@ class Task:
         """
         if self.time_left == self.service_time:
             self.start_time = self.state.timer.get_time()
-        self.time_left -= time_increment
+        self.advance(time_increment)
 
         # Any processing that must be done with the decremented timer but before the time left is checked
         self.process_logic()
@@ -63,6 +72,15 @@ class Task:
             self.completion_time = self.state.timer.get_time()
             self.on_complete()
 
+    def advance(self, time_increment):
+        """Count down the time left of the task, with any accounting its type does on each time step."""
+        self.time_left -= time_increment
+
+    def can_advance(self, time_increment):
+        """True if processing the task for the given time step only needs advance(): it has already started and does not
+        complete in that time. Subclasses with more processing must opt in by overriding this."""
+        return type(self) == Task and self.time_left != self.service_time and self.time_left > time_increment
+
     def process_logic(self):
         """Any processing that must be done with the decremented timer but before the time left is checked."""
         pass
@@ -70,7 +88,7 @@ class Task:
     def on_complete(self):
         """Complete the task and do any necessary accounting."""
         # Want to track how many vanilla tasks get completed
-        self.state.complete_task_count += 1
+        self.state.complete_task(self)
 
     def is_zero_duration(self):
         """True if the task has zero service time."""
@@ -90,14 +108,17 @@ class Task:
         return "Task (arrival {}, service time {}, original queue: {})".format(
             self.arrival_time, self.service_time, self.original_queue)
 
-    def get_stats(self):
+    def get_stat_values(self):
+        """Return the task's stats (matching the stat headers) without converting them to strings."""
         stats = [self.arrival_time, self.time_in_system(), self.service_time, self.steal_count, self.original_queue,
                  self.queued_ahead, self.total_queue, self.queue_checks, self.front_task_time, self.requeue_wait_time()]
 
         if self.config.delay_flagging_enabled:
             stats += [self.flag_steal_count, self.flag_wait_time, self.flag_set_delay, int(self.flagged), self.flagged_time_left]
+        return stats
 
-        stats = [str(x) for x in stats]
+    def get_stats(self):
+        stats = [str(x) for x in self.get_stat_values()]
         return stats
 
     @staticmethod
@@ -108,6 +129,15 @@ class Task:
             headers += ["Flag Steal Count", "Flag Wait Time", "Flag Set Delay", "Flagged", "Flagged Time Left"]
         return headers
 
+    @staticmethod
+    def get_stat_types(config):
+        """Return the binary record type of each stat (matching the stat headers). Only the arrival time can need more
+        than 32 bits, and queue ids, steal counts and flags fit in 16 or 8 (all are signed to allow MISSING_VALUE)."""
+        types = [time_type(config.sim_duration), INT32, INT32, INT16, INT16, INT32, INT32, INT32, INT32, INT32]
+        if config.delay_flagging_enabled:
+            types += [INT16, INT32, INT32, INT8, INT32]
+        return types
+
     def __str__(self):
         if not self.complete:
             return self.descriptor() + ": time left of {}".format(self.time_left)
@@ -121,6 +151,8 @@ class Task:
 class AbstractWorkStealTask(Task):
     """Class to implement common functionality between different forms of work stealing tasks."""
 
+    __slots__ = ("thread", "work_found", "checked_all", "check_count")
+
     def __init__(self, thread, initial_time, config, state):
         super().__init__(initial_time, state.timer.get_time(), config, state)
         self.thread = thread
@@ -180,7 +212,8 @@ class AbstractWorkStealTask(Task):
         # Can work steal, record a successful check
         self.state.record_ws_check(self.thread.id, remote, self.check_count, successful=True)
 
-        logging.debug("Thread {} work stealing from queue {}".format(self.thread.id, remote.id))
+        if self.state.debug_logging:
+            logging.debug("Thread {} work stealing from queue {}".format(self.thread.id, remote.id))
         return True
 
     def work_steal(self):
@@ -190,13 +223,10 @@ class AbstractWorkStealTask(Task):
         self.state.overall_steal_count += 1
 
         queue_length = self.remote.length()
-
-        # Avoid inverting the order of stolen tasks (stolen enqueues go to front of queue)
-        stolen_tasks = []
-        for i in range(math.ceil(queue_length / 2)):
-            stolen_tasks.insert(0, self.remote.dequeue())
-        for task in stolen_tasks:
-            self.thread.queue.enqueue(task, stolen=True)
+        num_to_steal = math.ceil(queue_length / 2)
+        self.thread.queue.steal_from(self.remote, num_to_steal)
+        if self.state.trace is not None:
+            self.state.trace.record(event_trace.WORK_STEAL, self.thread.id, self.remote.id, num_to_steal)
 
         self.remote.unlock(self.thread.id)
 
@@ -204,6 +234,8 @@ class AbstractWorkStealTask(Task):
 class ReallocationTask(Task):
     """Task to delay allocation."""
 
+    __slots__ = ("thread",)
+
     def __init__(self, thread, config, state):
         super().__init__(config.ALLOCATION_TIME, state.timer.get_time(), config, state)
         self.is_productive = False
@@ -233,6 +265,8 @@ class ReallocationTask(Task):
 class WorkSearchSpin(Task): # TODO: Check the preemption for double-counting
     """Task to spin a thread (not idle, but preemptable) if there is nothing else to do."""
 
+    __slots__ = ("thread",)
+
     def __init__(self, thread, config, state):
         super().__init__(config.MINIMUM_WORK_SEARCH_TIME, state.timer.get_time(), config, state)
         self.is_productive = False
@@ -250,8 +284,7 @@ class WorkSearchSpin(Task): # TODO: Check the preemption for double-counting
 
         # If you are work stealing and there is any work available in the system, preempt
         elif self.thread.work_search_state == WorkSearchState.WORK_STEAL_CHECK\
-                and any(q.work_available() and q.try_get_lock(self.thread.id, get_lock=False)
-                        for q in self.state.queues):
+                and self.state.any_work_available_to(self.thread.id):
             self.preempted = True
             self.complete = True
 
@@ -265,7 +298,7 @@ class WorkSearchSpin(Task): # TODO: Check the preemption for double-counting
         else:
             super().process(time_increment=time_increment)
 
-        if not self.preempted and any(q.work_available() for q in self.state.queues):
+        if not self.preempted and self.state.any_work_available():
             self.thread.non_work_conserving_time += time_increment
 
     def on_complete(self):
@@ -281,6 +314,8 @@ class WorkSearchSpin(Task): # TODO: Check the preemption for double-counting
 class IdleTask(Task):
     """Task to spin a thread idly while there is nothing to do."""
 
+    __slots__ = ()
+
     def __init__(self, time, config, state):
         super().__init__(time, state.timer.get_time(), config, state)
         self.is_idle = True
@@ -298,6 +333,8 @@ class IdleTask(Task):
 class EnqueuePenaltyTask(Task):
     """Task to spin through an enqueue penalty."""
 
+    __slots__ = ("thread", "from_preemption")
+
     def __init__(self, thread, config, state, preempted=False):
         super().__init__(config.ENQUEUE_PENALTY, state.timer.get_time(), config, state)
         self.is_productive = False
@@ -330,6 +367,8 @@ class EnqueuePenaltyTask(Task):
 class RequeueTask(Task):
     """Task to distribute queued work across newly allocated cores."""
 
+    __slots__ = ("thread",)
+
     def __init__(self, thread, config, state):
         super().__init__(0, state.timer.get_time(), config, state)
         self.is_productive = False
@@ -372,11 +411,17 @@ class RequeueTask(Task):
 class OracleWorkStealTask(AbstractWorkStealTask):
     """Work stealing task with oracle for making best possible decision."""
 
+    __slots__ = ()
+
     def __init__(self, thread, config, state):
         super().__init__(thread, config.WORK_STEAL_TIME, config, state)
 
     def choose_remote(self):
         """Choose the remote queue based on longest queueing delay."""
+        if self.state.queue_heads is not None and not self.config.locking_enabled and not self.config.record_steals:
+            self.choose_oldest_remote()
+            return
+
         delays = []
         # queue_lens = []
         queue_options = []
@@ -390,6 +435,20 @@ class OracleWorkStealTask(AbstractWorkStealTask):
             self.remote = self.state.queues[chosen_id]
             self.remote.try_get_lock(self.thread.id)
 
+    def choose_oldest_remote(self):
+        """Choose the remote queue with the oldest head task from the queue head index.
+        Without locking, every queue with tasks other than the thread's own can be stolen from, so this matches
+        checking each queue in turn. The checks of all queues with tasks are counted as a single sweep.
+        """
+        checked_queues = len(self.state.nonempty_queues)
+        self.check_count += checked_queues
+        self.state.global_check_count += checked_queues
+        self.state.queue_sweep_count += 1
+
+        self.remote = self.state.oldest_queue(exclude=self.thread.queue.id)
+        if self.remote is not None:
+            self.remote.try_get_lock(self.thread.id)
+
     def is_done(self):
         """Task is complete if work is found or has searched the minimum required time."""
         return self.remote or self.service_time >= self.config.MINIMUM_WORK_SEARCH_TIME
@@ -427,6 +486,8 @@ class OracleWorkStealTask(AbstractWorkStealTask):
 class QueueCheckTask(Task):
     """Task to check the local queue of a thread."""
 
+    __slots__ = ("thread", "locked_out", "return_to_work_steal", "ws_task", "start_work_search_spin")
+
     def __init__(self, thread, config, state, return_to_ws_task=None):
         super().__init__(config.LOCAL_QUEUE_CHECK_TIME, state.timer.get_time(), config, state)
         self.thread = thread
@@ -492,6 +553,9 @@ class QueueCheckTask(Task):
 class WorkStealTask(AbstractWorkStealTask):
     """Task to attempt to steal work from other queues."""
 
+    __slots__ = ("original_search_index", "search_index", "local_check_timer", "to_search",
+                 "candidate_remote")
+
     def __init__(self, thread, config, state):
         super().__init__(thread, None, config, state)
         self.state.work_steal_tasks += 1
@@ -541,14 +605,23 @@ class WorkStealTask(AbstractWorkStealTask):
             self.work_search_walk()
 
     def process(self, time_increment=1):
-        """Process task and update work steal accounting."""
+        """Process task (work steal accounting is done as it advances)."""
+        super().process(time_increment=time_increment, stop_condition=self.is_done)
+
+    def advance(self, time_increment):
+        """Count down the task and update work steal accounting."""
         if not self.is_zero_duration():
             self.thread.work_stealing_time += time_increment
-            if any(q.work_available() for q in self.state.queues):
+            if self.state.any_work_available():
                 self.thread.non_work_conserving_time += time_increment
             if self.config.ws_self_checks:
                 self.local_check_timer -= time_increment
-        super().process(time_increment=time_increment, stop_condition=self.is_done)
+        super().advance(time_increment)
+
+    def can_advance(self, time_increment):
+        """True if the search is between steps for the whole time step and no check of the local queue is due."""
+        return self.time_left != self.service_time and self.time_left > time_increment and \
+            not (self.config.ws_self_checks and self.local_check_timer <= time_increment)
 
     def delay_flag_check(self):
         """Check if the thread has a work steal flag it should respond to. If it does, take that task."""
@@ -682,6 +755,8 @@ class WorkStealTask(AbstractWorkStealTask):
 class FlagStealTask(Task):
     """Task to respond to a work steal flag."""
 
+    __slots__ = ("thread", "remote_thread", "ws_task", "num_to_steal", "can_respond")
+
     def __init__(self, thread, config, state, return_to_ws_task=None):
         overhead = config.FLAG_STEAL_DELAY
         super().__init__(overhead, state.timer.get_time(), config, state)
@@ -709,9 +784,13 @@ class FlagStealTask(Task):
         # Check if local thread can steal from remote
         if self.can_respond:
             self.flag_steal()
-            logging.debug("Thread {} flag stole from thread {}".format(self.thread.id, self.remote.id))
+            if self.state.debug_logging:
+                logging.debug("Thread {} flag stole from thread {}".format(self.thread.id, self.remote.id))
         else:
-            logging.debug("Thread {} cannot steal from thread {}".format(self.thread.id, self.remote.id))
+            if self.state.trace is not None:
+                self.state.trace.record(event_trace.FLAG_STEAL_FAILED, self.thread.id, self.remote.id)
+            if self.state.debug_logging:
+                logging.debug("Thread {} cannot steal from thread {}".format(self.thread.id, self.remote.id))
 
         # Regardless of outcome, mark that the flag has been responded to
         self.mark_flag_response()
@@ -733,6 +812,8 @@ class FlagStealTask(Task):
         """Remove the flag from the remote and reset associated clocks."""
         self.remote.unlock(self.thread.id)
         self.thread.work_steal_flag = None
+        if self.state.flag_helpers is not None:
+            self.state.flag_helpers.update(self.thread)
         self.remote_thread.flag_sent = False
         self.remote_thread.threshold_time = None
 
@@ -755,17 +836,11 @@ class FlagStealTask(Task):
         self.state.flag_steal_count += 1
 
         num_to_steal = self.tasks_to_steal()
-
-        # Avoid inverting the order of stolen tasks (stolen enqueues go to front of queue)
-        stolen_tasks = []
-        for i in range(num_to_steal):
-            stolen_tasks.insert(0, self.remote.dequeue())
-        for task in stolen_tasks:
-            self.thread.queue.enqueue(task, stolen=True, flag_steal=True, flag_time=self.remote_thread.flag_time,
-                                      threshold_time=self.remote_thread.threshold_time)
-
-        if self.config.ideal_flag_steal:
-            self.thread.queue.sort_by_arrival()
+        if self.state.trace is not None:
+            self.state.trace.record(event_trace.FLAG_STEAL, self.thread.id, self.remote.id, num_to_steal)
+        self.thread.queue.steal_from(self.remote, num_to_steal, flag_time=self.remote_thread.flag_time,
+                                     threshold_time=self.remote_thread.threshold_time,
+                                     merge_by_arrival=self.config.ideal_flag_steal)
 
         self.remote_thread.flag_wait_time += (self.state.timer.get_time() - self.remote_thread.flag_time)
 
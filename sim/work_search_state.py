@@ -5,6 +5,8 @@
 class WorkSearchState:
     """Status of a thread in the work search process."""
 
+    __slots__ = ("_state", "thread_id", "config", "sim_state", "search_start_time")
+
     ALLOCATING = 0
     LOCAL_QUEUE_FIRST_CHECK = 1
     WORK_STEAL_CHECK = 2
@@ -12,21 +14,23 @@ class WorkSearchState:
     PARKING = 4
     PARKED = 5
 
-    def __init__(self, config, state):
+    def __init__(self, config, state, thread_id=None):
         self._state = self.LOCAL_QUEUE_FIRST_CHECK
+        self.thread_id = thread_id
         self.config = config
         self.sim_state = state
         self.search_start_time = None
 
     def advance(self):
         """Move to the next state (stays in local queue first check if work stealing is disabled)."""
-        self._state = (self._state + 1) if self._state < self.PARKED else self.PARKED
         if not self.config.work_stealing_enabled:
-            self._state = self.LOCAL_QUEUE_FIRST_CHECK
+            self.set_state(self.LOCAL_QUEUE_FIRST_CHECK)
+        else:
+            self.set_state((self._state + 1) if self._state < self.PARKED else self.PARKED)
 
     def reset(self, clear_start_time=True):
         """Reset state to first local queue check and optionally reset the timer for current search."""
-        self._state = self.LOCAL_QUEUE_FIRST_CHECK
+        self.set_state(self.LOCAL_QUEUE_FIRST_CHECK)
         if clear_start_time:
             self.search_start_time = None
 
@@ -37,15 +41,22 @@ class WorkSearchState:
 
     def parking(self):
         """Set thread status to parking."""
-        self._state = self.PARKING
+        self.set_state(self.PARKING)
 
     def park(self):
         """Set thread status to parked."""
-        self._state = self.PARKED
+        self.set_state(self.PARKED)
 
     def allocate(self):
         """Set thread status to allocating."""
-        self._state = self.ALLOCATING
+        self.set_state(self.ALLOCATING)
+
+    def set_state(self, new_state):
+        """Change state, updating the flag helper index if the thread becomes active or inactive."""
+        was_active = self.is_active()
+        self._state = new_state
+        if self.sim_state.flag_helpers is not None and self.is_active() != was_active:
+            self.sim_state.flag_helpers.update(self.sim_state.threads[self.thread_id])
 
     def is_active(self):
         """Returns true if core is not parked or allocating."""